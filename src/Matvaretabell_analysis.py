@@ -3,81 +3,26 @@ import matplotlib.pyplot as plt
 import pandas as pd
 import seaborn as sns
 import os
-
-# Load the Excel file
-file_path = os.path.join(os.path.dirname(__file__), '..', 'data', 'raw', 'matvaretabell', 'all-foods.xlsx')
-xls = pd.ExcelFile(file_path)
-
-# Load the required sheet
-foods_nutrients_df = pd.read_excel(xls, sheet_name='Foods (all nutrients)')
-
-# Step 1: Identify rows where 'Matvare ID' contains non-numeric values, which represent the main categories
-foods_nutrients_df['IsMainCategory'] = foods_nutrients_df['Matvare ID'].apply(lambda x: not str(x).replace('.', '').isnumeric())
-
-# Step 2: Forward-fill the main category names into a new 'Main Category' column
-foods_nutrients_df['Main Category'] = foods_nutrients_df['Matvare ID'].where(foods_nutrients_df['IsMainCategory']).ffill()
-
-# Step 3: Keep 'Matvare ID' in the cleaned DataFrame for debugging and traceability
-foods_nutrients_cleaned = foods_nutrients_df[~foods_nutrients_df['IsMainCategory']]
-
-# Select necessary columns for analysis, including 'Matvare ID' for debugging
-nutrients_selected = foods_nutrients_cleaned[['Main Category', 'Matvare', 'Matvare ID', 'Protein (g)', 'Fat (g)', 'Carbohydrate (g)', 'Water (g)', 
-                                              'Phosphorus (P) (mg)', 'Sugar, total (g)']]
-
-# Merge with additional nutritional data if necessary (e.g., kilocalories)
-foods_df = pd.read_excel(xls, sheet_name='Foods')
-foods_selected = foods_df[['Matvare', 'Kilokalorier (kcal)', 'Spiselig del (%)']]
-
-# Merge the two DataFrames (including 'Matvare ID' for traceability)
-df_nutrient_totals = pd.merge(nutrients_selected, foods_selected, on='Matvare', how='inner')
-
-# Calculate percent dry matter
-df_nutrient_totals['Percent Dry Matter'] = 100 - df_nutrient_totals['Water (g)']
-
-# Rename 'Main Category' to 'FoodCategory' for clarity
-df_nutrient_totals.rename(columns={'Main Category': 'FoodCategory'}, inplace=True)
-
-# Updated category mapping
-category_mapping = {
-    'Fruit and berries': 'Fruits and nuts',
-    'Nuts and seeds': 'Fruits and nuts',
-    'Vegetables': 'Vegetables',
-    'Potatoes': 'Starchy vegetables',
-    'Cereals, bread and cakes': 'Grains and cereals',
-    'Dairy products': 'Dairy and alternatives',
-    'Meat and poultry': 'Red meat',  # We'll handle poultry separately using the classify_meat function
-    'Egg': 'Eggs',
-    'Fish and shellfish': 'Fish',
-    'Legumes': 'Legumes',
-    'Herbs and spices': 'Miscellaneous',
-    'Sugar and sweet products': 'Sweets and snacks',
-    'Beverages': 'Beverages',
-    'Other foods and dishes': 'Miscellaneous',
-    'Cooking fat': 'Fats and oils',
-    'Infant food': 'Miscellaneous'
-}
-
-# Function to classify poultry separately from red meat within the 'Meat and poultry' category
-def classify_meat(item, category):
-    # If the category is "Red meat", we classify it based on keywords for poultry
-    if category == 'Red meat':
-        item_lower = item.lower()
-        if 'chicken' in item_lower or 'poultry' in item_lower or 'turkey' in item_lower or 'hen' in item_lower or 'duck' in item_lower:
-            return 'Poultry'  # Reclassify as Poultry if these keywords are found
-        else:
-            return 'Red meat'  # Explicitly return 'Red meat' if no poultry keywords are found
-    return category  # Otherwise, keep the category as-is
-
-# Map 'FoodCategory' to new categories using 'category_mapping'
-df_nutrient_totals['Category'] = df_nutrient_totals['FoodCategory'].map(category_mapping)
-# If any 'FoodCategory' is not in 'category_mapping', keep the original
+from harmonization import map_labels
+from schema import normalize
+from food_classifier import classify_items
+from composition_store import load_composition_store
+
+# Load the item-level composition of all-foods.xlsx. The items are kept in a store keyed by 'Matvare ID',
+# so the workbook is only parsed and merged again when it changes
+store = load_composition_store()
+df_nutrient_totals = store.to_frame()
+
+# Map 'FoodCategory' to the study categories with the Matvaretabell mapping of the registry
+df_nutrient_totals['Category'] = map_labels(df_nutrient_totals['FoodCategory'], 'matvaretabell')
+# If any 'FoodCategory' is not in the mapping, keep the original
 df_nutrient_totals['Category'] = df_nutrient_totals['Category'].fillna(df_nutrient_totals['FoodCategory'])
 
-# Applying the classification to the DataFrame correctly
-df_nutrient_totals['Category'] = df_nutrient_totals.apply(
-    lambda row: classify_meat(row['Matvare'], row['Category']),
-    axis=1
-)
+# Classify poultry separately from red meat within the 'Meat and poultry' category by keywords in the item name
+meat_classification = classify_items(df_nutrient_totals['Matvare'], df_nutrient_totals['Category'])
+df_nutrient_totals['Category'] = meat_classification['Category']
+print("Items reclassified per rule and keyword:")
+print(meat_classification.groupby(['Rule', 'Keyword']).size())
 
 # Check if poultry is classified correctly
 print("Sample of Poultry items:")
@@ -86,16 +31,19 @@ print(df_nutrient_totals[df_nutrient_totals['Category'] == 'Poultry'][['Matvare'
 print("Sample of Red meat items:")
 print(df_nutrient_totals[df_nutrient_totals['Category'] == 'Red meat'][['Matvare', 'Category']].head())
 
-# Group the data by the new 'Category' and recalculate the average nutrient values
-category_averages_combined = df_nutrient_totals.groupby('Category').mean()
+# Average nutrient values of the items in each new 'Category'
+category_averages_combined = store.category_composition(df_nutrient_totals['Category'])
 
 #'01.332' is an outlier:
 category_averages_combined.drop('01.332 ', inplace=True)
 #Rename Category to FoodCategory
 category_averages_combined.rename(index={'FoodCategory': 'Category'}, inplace=True)
+# Every remaining category is a study category of the shared schema, an unknown label raises here
+category_averages_combined.index = pd.CategoricalIndex(normalize(category_averages_combined.index, 'FoodCategory'),
+                                                       name=category_averages_combined.index.name)
 
 # Export the results to an Excel file
-output_path = os.path.join(os.path.dirname(__file__), '..', 'data', 'auxillary', 'food_composition.xlsx')
+output_path = os.path.join(os.path.dirname(__file__), '..', 'data', 'auxiliary', 'food_composition.xlsx')
 category_averages_combined.to_excel(output_path)
 
 # Print the unique categories to ensure Poultry and Red meat are correctly separated
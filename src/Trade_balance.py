@@ -4,63 +4,23 @@ import numpy as np
 import seaborn as sns
 import matplotlib.pyplot as plt
 import os
+from trade_store import load_trade_store
 
-#%% Load the Excel files from the SSB folder in raw
-#Trade data
-file_path = os.path.join(os.path.dirname(__file__), '..', 'data', 'raw', 'ssb')
-trade_filename = 'Imports and exports of food.xlsx'
-trade_df = pd.read_excel(os.path.join(file_path, trade_filename), header=3)
+#%% Load the trade store
+# SITC divisions summed into food categories per flow and year. The store is saved as Parquet in
+# data/cache/trade, and new SSB year columns in 'Imports and exports of food.xlsx' are appended to it.
+trade_store = load_trade_store()
+years = list(trade_store.years)
 
-# Flashfill the 'Type' column with values from 'Unnamed: 0'
-trade_df['Type'] = trade_df['Unnamed: 0'].ffill()
-trade_df.drop(columns='Unnamed: 0', inplace=True)
+# Imports and exports by food category (rows) and year (columns). The SITC divisions only give the
+# coarser trade categories of the 'trade' mapping (e.g. 'Meat', 'Dairy and eggs'), which are not FoodCategory
+# labels of the schema; supply_balance.align_terms maps them and the schema categories to the balance categories.
+imports_df = trade_store.series('Imports')
+exports_df = trade_store.series('Exports')
 
-# Rename 'Unnamed: 1' to 'Food Category'
-trade_df.rename(columns={'Unnamed: 1': 'Food Category'}, inplace=True)
-
-# Drop rows with missing values
-trade_df.dropna(inplace=True)
-
-# Create a dictionary to map the food categories
-category_mapping = {
-    '00 Live animals other than animals of div.03': 'Meat',
-    '01 Meat and meat preparations': 'Meat',
-    "02 Dairy products and birds' eggs": 'Dairy and eggs',
-    '03 Fish, crustaceans, molluscs and prep. thereof': 'Fish',
-    '04 Cereals and cereal preparations': 'Grains and cereals',
-    '05 Vegetables and fruit': 'Vegetables and Fruits',
-    '06 Sugars, sugar preparations and honey': 'Sweets and snacks',
-    '07 Coffee, tea, cocoa, spices': 'Miscellaneous',
-    '09 Miscellaneous edible products': 'Miscellaneous',
-    '11 Beverages': 'Beverages',
-    '22 Oil seeds and oleaginous fruits': 'Fats and oils',
-    '42 Fixed vegetable fats and oils, crude, refined or fractionated': 'Fats and oils',
-    '43 Animal or vegetable fats and oils, processed': 'Fats and oils'
-}
-
-# Map the 'Food Category' values using the dictionary
-trade_df['Food Category'] = trade_df['Food Category'].map(category_mapping)
-
-# Drop rows with NA values after mapping
-trade_df.dropna(inplace=True)
-
-# Group by 'Food Category' and 'Type', summing the values for each year
-trade_df_grouped = trade_df.groupby(['Food Category', 'Type'])[['2019', '2020', '2021', '2022', '2023']].sum().reset_index()
-
-# Separate into Imports and Exports DataFrames
-imports_df = trade_df_grouped[trade_df_grouped['Type'] == 'Imports'].set_index('Food Category')
-exports_df = trade_df_grouped[trade_df_grouped['Type'] == 'Exports'].set_index('Food Category')
-
-# Creating trade_df_avg where the average of the years is calculated
-years = ['2019', '2020', '2021', '2022', '2023']
-trade_df_avg = trade_df_grouped.copy()
-trade_df_avg['Average'] = trade_df_avg[years].mean(axis=1)
-
-#Export the trade_df_avg to a new Excel file in auxillary
-file_path = os.path.join(os.path.dirname(__file__), '..', 'data', 'auxillary', 'Trade_balance.xlsx')
-# Separate into Imports and Exports DataFrames with average
-imports_df_avg = trade_df_avg[trade_df_avg['Type'] == 'Imports'].set_index('Food Category')
-exports_df_avg = trade_df_avg[trade_df_avg['Type'] == 'Exports'].set_index('Food Category')
+# Average of the years for each type
+imports_df_avg = imports_df.assign(Average=trade_store.average('Imports'))
+exports_df_avg = exports_df.assign(Average=trade_store.average('Exports'))
 
 #%%
 #dict for colors
@@ -95,7 +55,7 @@ imports_df.loc[categories_in_order, years].T.plot(
 )
 
 # Customize the plot for Imports
-ax.set_title('Imports by Food Category (2019-2023)')
+ax.set_title(f'Imports by Food Category ({years[0]}-{years[-1]})')
 ax.set_xlabel('Year')
 ax.set_ylabel('Tons')
 plt.xticks(rotation=0)
@@ -118,7 +78,7 @@ exports_df.loc[categories_in_order, years].T.plot(
 )
 
 # Customize the plot for Exports
-ax.set_title('Exports by Food Category (2019-2023)')
+ax.set_title(f'Exports by Food Category ({years[0]}-{years[-1]})')
 ax.set_xlabel('Year')
 ax.set_ylabel('Tons')
 plt.xticks(rotation=0)
@@ -0,0 +1,131 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from schema import dimensions
+
+# Replicates per chunk, a chunk holds a (replicates x respondents) count matrix
+CHUNK_REPLICATES = 250
+
+
+#%% Resampling
+def group_design(df, categories, by=('Gender', 'AgeGroup'), weights=None):
+    # Respondents sorted by group with the sparse (respondents x groups * (categories + 1)) block
+    # matrix of their weighted amounts and weights: a respondent of group g fills the block of g,
+    # so resample counts times this matrix give every group sum and group weight in one product
+    by = list(by)
+    levels = [dimensions[name][0].categories for name in by]
+    codes = [df[name].astype(dimensions[name][0]).cat.codes.to_numpy() for name in by]
+    if any((code < 0).any() for code in codes):
+        raise ValueError(f'Respondents without a label of {by}, every respondent needs one')
+    groups = np.ravel_multi_index(codes, tuple(len(level) for level in levels))
+    order = np.argsort(groups, kind='stable')
+    groups = groups[order]
+    w = np.ones(len(df)) if weights is None else df[weights].to_numpy(dtype=float)[order]
+    amounts = df[list(categories)].to_numpy(dtype=float)[order]
+
+    n_groups = int(np.prod([len(level) for level in levels]))
+    width = len(categories) + 1
+    block = np.column_stack([amounts, np.ones(len(df))]) * w[:, None]
+    columns = groups[:, None] * width + np.arange(width)
+    design = sparse.csr_matrix((block.ravel(), (np.repeat(np.arange(len(df)), width), columns.ravel())),
+                               shape=(len(df), n_groups * width))
+    sizes = np.bincount(groups, minlength=n_groups)
+    index = pd.MultiIndex.from_product([pd.CategoricalIndex(level, dtype=dimensions[name][0]) for name, level in zip(by, levels)],
+                                       names=by)
+    return design, groups, sizes, index
+
+
+def resample_counts(groups, sizes, n_replicates, rng):
+    # (replicates x respondents) sparse counts of a stratified bootstrap: every replicate draws as many
+    # respondents from each group as it has, with replacement
+    starts = np.concatenate([[0], np.cumsum(sizes)[:-1]])
+    draws = starts[groups] + (rng.random((n_replicates, len(groups))) * sizes[groups]).astype(np.int64)
+    rows = np.repeat(np.arange(n_replicates), len(groups))
+    # Repeated draws of a respondent are summed when the matrix is built
+    return sparse.csr_matrix((np.ones(draws.size), (rows, draws.ravel())), shape=(n_replicates, len(groups)))
+
+
+def group_means(totals, n_groups):
+    # (..., groups, categories) means from the group sums and weights of the design product
+    totals = totals.reshape(totals.shape[:-1] + (n_groups, -1))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return totals[..., :-1] / totals[..., -1:]
+
+
+# The design of the running bootstrap, set once in every process by use_design instead of being sent
+# with every chunk
+shared_design = {}
+
+
+def use_design(design, groups, sizes):
+    shared_design.update(design=design, groups=groups, sizes=sizes)
+
+
+def replicate_chunk(memory_name, shape, start, stop, seed):
+    # Means of the replicates start..stop, written into the shared result array
+    memory = shared_memory.SharedMemory(name=memory_name)
+    try:
+        replicates = np.ndarray(shape, dtype=float, buffer=memory.buf)
+        counts = resample_counts(shared_design['groups'], shared_design['sizes'], stop - start, np.random.default_rng(seed))
+        replicates[start:stop] = group_means((counts @ shared_design['design']).toarray(), shape[1])
+    finally:
+        memory.close()
+
+
+#%% Bootstrap
+def replicate_means(design, groups, sizes, n_groups, n_categories, n_replicates=10_000,
+                    chunk_replicates=CHUNK_REPLICATES, seed=0, processes=1):
+    # (replicates, groups, categories) group means of the replicates of a group_design. The chunks write
+    # into one shared-memory array, in parallel with processes > 1; the design is sent to every worker once
+    # by the pool initializer. Every chunk has its own seed from one SeedSequence, so the replicates do not
+    # depend on the number of processes.
+    shape = (n_replicates, n_groups, n_categories)
+    bounds = [(start, min(start + chunk_replicates, n_replicates)) for start in range(0, n_replicates, chunk_replicates)]
+    seeds = np.random.SeedSequence(seed).spawn(len(bounds))
+
+    memory = shared_memory.SharedMemory(create=True, size=int(np.prod(shape)) * 8)
+    try:
+        args = [(memory.name, shape, start, stop, chunk_seed) for (start, stop), chunk_seed in zip(bounds, seeds)]
+        if processes == 1 or len(bounds) == 1:
+            use_design(design, groups, sizes)
+            for chunk_args in args:
+                replicate_chunk(*chunk_args)
+        else:
+            with ProcessPoolExecutor(max_workers=processes or os.cpu_count(), initializer=use_design,
+                                     initargs=(design, groups, sizes)) as pool:
+                list(pool.map(replicate_chunk, *zip(*args)))
+        return np.ndarray(shape, dtype=float, buffer=memory.buf).copy()
+    finally:
+        memory.close()
+        memory.unlink()
+
+
+def bootstrap_means(df, categories, by=('Gender', 'AgeGroup'), weights=None, **options):
+    # (replicates, groups, categories) bootstrap distribution of the (weighted) group means, see replicate_means
+    design, groups, sizes, index = group_design(df, categories, by, weights)
+    return replicate_means(design, groups, sizes, len(index), len(categories), **options), index
+
+
+def bootstrap_intervals(df, categories, by=('Gender', 'AgeGroup'), weights=None, level=0.95, value_name='Average amount consumed (g)',
+                        **options):
+    # Long table with the group means of every category and the percentile interval of the bootstrap,
+    # groups without respondents are left out. The estimate and the replicates share one design.
+    design, groups, sizes, index = group_design(df, categories, by, weights)
+    estimate = group_means(np.asarray(design.sum(axis=0)).ravel(), len(index))
+    replicates = replicate_means(design, groups, sizes, len(index), len(categories), **options)
+    alpha = (1 - level) / 2
+    lower, upper = np.percentile(replicates, [100 * alpha, 100 * (1 - alpha)], axis=0)
+
+    rows = pd.MultiIndex.from_product([*index.levels, pd.Index(categories, name='FoodCategory')])
+    table = pd.DataFrame({
+        value_name: estimate.ravel(),
+        f'{value_name} CI lower': lower.ravel(),
+        f'{value_name} CI upper': upper.ravel(),
+    }, index=rows)
+    observed = np.repeat(sizes > 0, len(categories))
+    return table[observed].reset_index()
@@ -0,0 +1,285 @@
+#%%
+import argparse
+import ast
+import hashlib
+import json
+import os
+import subprocess
+import sys
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+# Paths are relative to the data folder, scripts are relative to the src folder
+SRC_DIR = os.path.dirname(os.path.abspath(__file__))
+DATA_DIR = os.path.join(SRC_DIR, '..', 'data')
+STATE_PATH = os.path.join(DATA_DIR, 'cache', 'build_state.json')
+
+# Each stage runs one script. A stage depends on every stage that writes one of its inputs.
+# Inputs that no stage writes are source files, they have to be in the data folder.
+stages = {
+    'food_composition': {
+        'script': 'Matvaretabell_analysis.py',
+        'inputs': ['raw/matvaretabell/all-foods.xlsx'],
+        'outputs': ['auxiliary/food_composition.xlsx'],
+    },
+    'norkost_percapita': {
+        'script': 'norkost_analysis.py',
+        'inputs': [
+            'raw/norkost/Norkost 3-data til NTNU.xlsx',
+            'raw/ssb/Population - age and gender.xlsx',
+            'raw/norkost/Norkost 2.xlsx',
+            'auxiliary/food_composition.xlsx',
+        ],
+        'outputs': [
+            'auxiliary/average percapita consumption_nk3.xlsx',
+            'auxiliary/average percapita consumption_nk2.xlsx',
+        ],
+    },
+    'norkost_average': {
+        'script': 'norkost3_analysis.py',
+        'inputs': [
+            'raw/norkost/Norkost 3-data til NTNU.xlsx',
+            'raw/ssb/Population - age and gender.xlsx',
+            'auxiliary/food_composition.xlsx',
+        ],
+        'outputs': ['auxiliary/average consumption.xlsx'],
+    },
+    'population_demand': {
+        'script': 'population_demand.py',
+        'inputs': [
+            'raw/ssb/Population - age and gender.xlsx',
+            'raw/iiasa/wicdf.csv',
+            'auxiliary/average percapita consumption_nk2.xlsx',
+            'auxiliary/average percapita consumption_nk3.xlsx',
+        ],
+        'outputs': [],
+    },
+    'trend_analysis': {
+        'script': 'trend_analysis.py',
+        'inputs': [
+            'auxiliary/average percapita consumption_nk2.xlsx',
+            'auxiliary/average percapita consumption_nk3.xlsx',
+        ],
+        'outputs': [],
+    },
+    'human_balance': {
+        'script': 'human_balance.py',
+        # A checked-in table of the per-capita nutrients by 10-year age group, no script writes it
+        'inputs': ['auxiliary/Average consumption by age and gender.xlsx'],
+        'outputs': ['auxiliary/human_balance.xlsx', 'auxiliary/human_balance_uncertainty.xlsx'],
+    },
+    'national_consumption': {
+        'script': 'national_consumption.py',
+        'inputs': [
+            'raw/helsedirektoratet/national consumption.xlsx',
+            'raw/helsedirektoratet/individual consumption.xlsx',
+            'auxiliary/average consumption.xlsx',
+        ],
+        'outputs': [],
+    },
+    'foodwaste': {
+        'script': 'foodwaste.py',
+        'inputs': [
+            'raw/matsvinn/matsvinn.xlsx',
+            'raw/ssb/Total population.xlsx',
+            'raw/ssb/Population - age and gender.xlsx',
+            'auxiliary/average percapita consumption_nk3.xlsx',
+        ],
+        'outputs': [],
+    },
+    'trade_balance': {
+        'script': 'Trade_balance.py',
+        'inputs': ['raw/ssb/Imports and exports of food.xlsx'],
+        'outputs': [],
+    },
+    'supply_balance': {
+        'script': 'national_balance.py',
+        'inputs': [
+            'raw/helsedirektoratet/national consumption.xlsx',
+            'raw/ssb/Imports and exports of food.xlsx',
+            'raw/matsvinn/matsvinn.xlsx',
+            'raw/ssb/Total population.xlsx',
+            'raw/ssb/Population - age and gender.xlsx',
+            'auxiliary/average percapita consumption_nk3.xlsx',
+        ],
+        'outputs': ['auxiliary/supply_balance.xlsx'],
+    },
+    'microsimulation': {
+        'script': 'population_microsim.py',
+        'inputs': [
+            'raw/norkost/Norkost 3-data til NTNU.xlsx',
+            'raw/ssb/Population - age and gender.xlsx',
+            'auxiliary/average percapita consumption_nk3.xlsx',
+        ],
+        'outputs': ['cache/microsim/population.json'],
+    },
+}
+
+
+#%% Graph helpers
+def local_imports(script, src_dir=SRC_DIR):
+    # The modules of src that script imports, directly or through other modules of src, found by
+    # walking the import statements of the source (also those inside functions)
+    found, pending = set(), [script]
+    while pending:
+        path = pending.pop()
+        with open(os.path.join(src_dir, path), encoding='utf-8') as f:
+            tree = ast.parse(f.read(), filename=path)
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Import):
+                names = [alias.name for alias in node.names]
+            elif isinstance(node, ast.ImportFrom) and node.level == 0 and node.module:
+                names = [node.module]
+            else:
+                continue
+            for name in names:
+                module = name.split('.')[0] + '.py'
+                if module != script and module not in found and os.path.exists(os.path.join(src_dir, module)):
+                    found.add(module)
+                    pending.append(module)
+    return sorted(found)
+
+
+def upstream_stages(stages):
+    producers = {output: name for name, stage in stages.items() for output in stage['outputs']}
+    return {
+        name: sorted({producers[path] for path in stage['inputs'] if path in producers} - {name})
+        for name, stage in stages.items()
+    }
+
+
+def select_stages(stages, targets):
+    # The targets together with everything they depend on
+    upstream = upstream_stages(stages)
+    selected = set()
+    pending = list(targets)
+    while pending:
+        name = pending.pop()
+        if name not in stages:
+            raise KeyError(f"Unknown stage '{name}', choose from {sorted(stages)}")
+        if name not in selected:
+            selected.add(name)
+            pending.extend(upstream[name])
+    return selected
+
+
+def missing_sources(stage, stages):
+    # Inputs of the stage that no stage writes and that are not in the data folder either
+    produced = {path for other in stages.values() for path in other['outputs']}
+    return [path for path in stage['inputs'] if path not in produced and not os.path.exists(os.path.join(DATA_DIR, path))]
+
+
+def fingerprint(stage):
+    # Hash of the script, the modules of src it imports and the content of every input, so changing a
+    # helper module also rebuilds the stage
+    digest = hashlib.sha256()
+    for path in [stage['script']] + local_imports(stage['script']):
+        digest.update(path.encode())
+        with open(os.path.join(SRC_DIR, path), 'rb') as f:
+            digest.update(f.read())
+    for path in stage['inputs']:
+        digest.update(path.encode())
+        full_path = os.path.join(DATA_DIR, path)
+        if not os.path.exists(full_path):
+            digest.update(b'<missing>')
+            continue
+        with open(full_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+
+def is_stale(name, stage, state):
+    if any(not os.path.exists(os.path.join(DATA_DIR, path)) for path in stage['outputs']):
+        return True
+    return state.get(name) != fingerprint(stage)
+
+
+def load_state(path=STATE_PATH):
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_state(state, path=STATE_PATH):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(state, f, indent=2, sort_keys=True)
+
+
+def run_stage(stage):
+    # The scripts use paths relative to src, and plt.show() must not block
+    env = dict(os.environ, MPLBACKEND='Agg')
+    result = subprocess.run(
+        [sys.executable, stage['script']],
+        cwd=SRC_DIR,
+        env=env,
+        capture_output=True,
+        text=True,
+    )
+    return result.returncode, result.stdout + result.stderr
+
+
+#%% Build
+def build(targets=None, jobs=None, force=False, dry_run=False):
+    selected = select_stages(stages, targets or list(stages))
+    upstream = {name: [dep for dep in deps if dep in selected] for name, deps in upstream_stages(stages).items() if name in selected}
+    state = load_state()
+
+    # A stage is checked once all its upstream stages are done, because their outputs are its inputs
+    done, failed, rebuilt = set(), set(), []
+    running = {}
+    with ThreadPoolExecutor(max_workers=jobs or os.cpu_count()) as pool:
+        while len(done) + len(failed) < len(selected):
+            for name in sorted(selected - done - failed - set(running.values())):
+                if any(dep in failed for dep in upstream[name]):
+                    print(f'[skip]  {name} (upstream stage failed)')
+                    failed.add(name)
+                elif all(dep in done for dep in upstream[name]):
+                    stage = stages[name]
+                    missing = missing_sources(stage, stages)
+                    if missing:
+                        print(f'[fail]  {name} (missing source inputs {missing})')
+                        failed.add(name)
+                    elif not force and not is_stale(name, stage, state):
+                        print(f'[fresh] {name}')
+                        done.add(name)
+                    elif dry_run:
+                        print(f'[stale] {name}')
+                        done.add(name)
+                    else:
+                        print(f'[run]   {name} ({stage["script"]})')
+                        running[pool.submit(run_stage, stage)] = name
+            if not running:
+                continue
+
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                name = running.pop(future)
+                returncode, output = future.result()
+                if returncode == 0:
+                    state[name] = fingerprint(stages[name])
+                    save_state(state)
+                    done.add(name)
+                    rebuilt.append(name)
+                else:
+                    print(f'[fail]  {name}\n{output[-2000:]}')
+                    failed.add(name)
+
+    return rebuilt, sorted(failed)
+
+
+#%%
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Rebuild the stale data products in data/auxiliary.')
+    parser.add_argument('targets', nargs='*', help='stages to build, together with their upstream stages (default: all)')
+    parser.add_argument('-j', '--jobs', type=int, default=None, help='number of stages to run in parallel')
+    parser.add_argument('--force', action='store_true', help='rebuild every selected stage')
+    parser.add_argument('--dry-run', action='store_true', help='only list the stale stages')
+    args = parser.parse_args()
+
+    rebuilt, failed = build(args.targets, args.jobs, args.force, args.dry_run)
+    print(f'Rebuilt: {rebuilt}')
+    if failed:
+        print(f'Failed: {failed}')
+        sys.exit(1)
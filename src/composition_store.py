@@ -0,0 +1,143 @@
+import json
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+
+from norkost_loader import file_digest
+
+ALL_FOODS_PATH = os.path.join(os.path.dirname(__file__), '..', 'data', 'raw', 'matvaretabell', 'all-foods.xlsx')
+
+# One store per workbook version in data/cache/composition/<digest>
+STORE_DIR = os.path.join(os.path.dirname(__file__), '..', 'data', 'cache', 'composition')
+# Bump this when parse_all_foods changes so old stores are rebuilt
+STORE_VERSION = 1
+
+# Nutrient columns of the 'Foods (all nutrients)' and 'Foods' sheets kept in the store
+nutrient_sheet_columns = ['Protein (g)', 'Fat (g)', 'Carbohydrate (g)', 'Water (g)', 'Phosphorus (P) (mg)', 'Sugar, total (g)']
+food_sheet_columns = ['Kilokalorier (kcal)', 'Spiselig del (%)']
+
+
+#%% Parse the Matvaretabell workbook
+def parse_all_foods(file_path=ALL_FOODS_PATH):
+    # One row per food item with its Matvaretabell main category and nutrients per 100 g
+    xls = pd.ExcelFile(file_path)
+    foods_nutrients_df = pd.read_excel(xls, sheet_name='Foods (all nutrients)')
+
+    # Rows whose 'Matvare ID' is not a number are the main category headers, forward-fill them to the items
+    is_main_category = foods_nutrients_df['Matvare ID'].apply(lambda x: not str(x).replace('.', '').isnumeric())
+    foods_nutrients_df['FoodCategory'] = foods_nutrients_df['Matvare ID'].where(is_main_category).ffill()
+    items = foods_nutrients_df.loc[~is_main_category, ['FoodCategory', 'Matvare', 'Matvare ID'] + nutrient_sheet_columns]
+
+    # Kilocalories and the edible part are on the 'Foods' sheet
+    foods_df = pd.read_excel(xls, sheet_name='Foods')
+    items = pd.merge(items, foods_df[['Matvare'] + food_sheet_columns], on='Matvare', how='inner')
+    items['Percent Dry Matter'] = 100 - items['Water (g)']
+    items['Matvare ID'] = items['Matvare ID'].astype(str)
+    return items.reset_index(drop=True)
+
+
+#%% Store
+class CompositionStore:
+    # Item-level food composition. values has one contiguous row per nutrient (nutrients x items),
+    # and the items are found through hash indexes on Matvare ID and name.
+    def __init__(self, ids, names, food_categories, nutrients, values):
+        self.ids = np.asarray(ids, dtype=object)
+        self.names = np.asarray(names, dtype=object)
+        self.food_categories = np.asarray(food_categories, dtype=object)
+        self.nutrients = list(nutrients)
+        self.values = values
+        self.id_index = {item_id: i for i, item_id in enumerate(self.ids)}
+        self.name_index = {name: i for i, name in enumerate(self.names)}
+        self.nutrient_index = {nutrient: i for i, nutrient in enumerate(self.nutrients)}
+
+    def __len__(self):
+        return len(self.ids)
+
+    def column(self, nutrient):
+        # Contiguous (items,) view of one nutrient
+        return self.values[self.nutrient_index[nutrient]]
+
+    def positions(self, ids=None, names=None):
+        # Row positions of items given by Matvare ID or by name, KeyError for unknown items
+        if ids is not None:
+            return np.array([self.id_index[item_id] for item_id in ids], dtype=int)
+        return np.array([self.name_index[name] for name in names], dtype=int)
+
+    def lookup(self, ids=None, names=None, nutrients=None):
+        positions = self.positions(ids, names) if ids is not None or names is not None else np.arange(len(self))
+        nutrients = nutrients or self.nutrients
+        rows = [self.nutrient_index[nutrient] for nutrient in nutrients]
+        df = pd.DataFrame({
+            'Matvare ID': self.ids[positions],
+            'Matvare': self.names[positions],
+            'FoodCategory': self.food_categories[positions],
+        })
+        df[nutrients] = np.asarray(self.values[rows][:, positions]).T
+        return df
+
+    def to_frame(self):
+        return self.lookup()
+
+    def category_composition(self, categories, weights=None):
+        # (categories x nutrients) composition, weighted by e.g. the consumed amount of each item.
+        # Without weights this is the plain mean per category; missing values are skipped per nutrient
+        # like in a groupby mean.
+        codes, labels = pd.factorize(pd.Series(categories), sort=True)
+        weights = np.ones(len(self)) if weights is None else np.asarray(weights, dtype=float)
+        values = np.asarray(self.values)
+        present = ~np.isnan(values) & (codes >= 0)
+        weighted = np.where(present, values * weights, 0.0)
+        counted = np.where(present, weights, 0.0)
+        n_categories = len(labels)
+        safe_codes = np.where(codes >= 0, codes, 0)
+        sums = np.stack([np.bincount(safe_codes, weights=row, minlength=n_categories) for row in weighted], axis=1)
+        totals = np.stack([np.bincount(safe_codes, weights=row, minlength=n_categories) for row in counted], axis=1)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            composition = sums / totals
+        return pd.DataFrame(composition, index=pd.Index(labels, name='Category'), columns=self.nutrients)
+
+
+#%% Persist and load
+def store_path(file_path, digest, store_dir=STORE_DIR):
+    workbook = os.path.splitext(os.path.basename(file_path))[0]
+    return os.path.join(store_dir, f'{workbook}__v{STORE_VERSION}__{digest[:16]}')
+
+
+def save_store(store, path):
+    os.makedirs(path, exist_ok=True)
+    np.save(os.path.join(path, 'values.npy'), np.ascontiguousarray(store.values, dtype=float))
+    with open(os.path.join(path, 'items.json'), 'w', encoding='utf-8') as f:
+        json.dump({
+            'ids': list(store.ids),
+            'names': list(store.names),
+            'food_categories': list(store.food_categories),
+            'nutrients': store.nutrients,
+        }, f, ensure_ascii=False)
+
+
+def read_store(path):
+    # The nutrient values are memory-mapped, only the item labels are read into memory
+    with open(os.path.join(path, 'items.json'), encoding='utf-8') as f:
+        items = json.load(f)
+    values = np.load(os.path.join(path, 'values.npy'), mmap_mode='r')
+    return CompositionStore(items['ids'], items['names'], items['food_categories'], items['nutrients'], values)
+
+
+def load_composition_store(file_path=ALL_FOODS_PATH, store_dir=STORE_DIR, rebuild=False):
+    # The workbook is only parsed when no store exists for its content
+    path = store_path(file_path, file_digest(file_path), store_dir)
+    if rebuild or not os.path.exists(os.path.join(path, 'items.json')):
+        items = parse_all_foods(file_path)
+        nutrients = nutrient_sheet_columns + food_sheet_columns + ['Percent Dry Matter']
+        store = CompositionStore(items['Matvare ID'], items['Matvare'], items['FoodCategory'], nutrients,
+                                 items[nutrients].to_numpy(dtype=float).T)
+        # Old versions of the same workbook are replaced
+        prefix = os.path.basename(path).split('__v')[0] + '__'
+        if os.path.isdir(store_dir):
+            for entry in os.listdir(store_dir):
+                if entry.startswith(prefix) and os.path.join(store_dir, entry) != path:
+                    shutil.rmtree(os.path.join(store_dir, entry), ignore_errors=True)
+        save_store(store, path)
+    return read_store(path)
@@ -0,0 +1,130 @@
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from schema import dimensions
+
+# Respondent dimensions of the cube, in axis order. The food categories are the last axis.
+CUBE_DIMENSIONS = ['Gender', 'AgeGroup', 'Region', 'Education']
+statistics = ['mean', 'sum', 'share']
+
+
+class ConsumptionCube:
+    # Sums of the consumed amounts and respondent counts for every cell of
+    # Gender x AgeGroup x Region x Education (x FoodCategory for the sums). Every roll-up or slice
+    # is answered from these aggregates, so a query never touches the respondent rows.
+    # With survey weights the sums are weighted and weights holds the summed weight of every cell,
+    # the means divide by it; without, weights are the counts.
+    def __init__(self, labels, categories, sums, counts, weights=None):
+        self.labels = labels
+        self.categories = pd.Index(categories, name='FoodCategory')
+        self.sums = sums
+        self.counts = counts
+        self.weights = counts if weights is None else weights
+
+    def selection(self, filters):
+        # Positions along every axis, a filter is one label or a list of labels
+        unknown = set(filters) - set(CUBE_DIMENSIONS) - {'FoodCategory'}
+        if unknown:
+            raise ValueError(f'Unknown cube dimensions: {sorted(unknown)}')
+        positions = []
+        for dimension in CUBE_DIMENSIONS + ['FoodCategory']:
+            index = self.categories if dimension == 'FoodCategory' else self.labels[dimension]
+            if dimension not in filters:
+                positions.append(np.arange(len(index)))
+                continue
+            selected = filters[dimension]
+            selected = [selected] if isinstance(selected, str) else list(selected)
+            indexer = index.get_indexer(selected)
+            if (indexer < 0).any():
+                missing = [label for label, i in zip(selected, indexer) if i < 0]
+                raise KeyError(f'{dimension} labels not in the cube: {missing}')
+            positions.append(indexer)
+        return positions
+
+    def rollup(self, by, filters):
+        # Sums (by... x categories), counts and weights (by...) over the selected cells
+        by = [by] if isinstance(by, str) else list(by)
+        if set(by) - set(CUBE_DIMENSIONS):
+            raise ValueError(f'Can only group by {CUBE_DIMENSIONS}, got {by}')
+        positions = self.selection(filters)
+        sums = self.sums[np.ix_(*positions)]
+        counts = self.counts[np.ix_(*positions[:-1])]
+        weights = self.weights[np.ix_(*positions[:-1])]
+        kept = [CUBE_DIMENSIONS.index(dimension) for dimension in by]
+        dropped = tuple(axis for axis in range(len(CUBE_DIMENSIONS)) if axis not in kept)
+        # Summing keeps the remaining axes in cube order, move them to the order of 'by'
+        order = np.argsort(np.argsort(kept)).tolist()
+        sums = sums.sum(axis=dropped).transpose(order + [len(kept)])
+        counts = counts.sum(axis=dropped).transpose(order)
+        weights = weights.sum(axis=dropped).transpose(order)
+        return by, positions, sums, counts, weights
+
+    def group_index(self, by, positions):
+        levels = []
+        for dimension in by:
+            labels = self.labels[dimension][positions[CUBE_DIMENSIONS.index(dimension)]]
+            levels.append(pd.CategoricalIndex(labels, dtype=dimensions[dimension][0], name=dimension))
+        if len(levels) == 1:
+            return levels[0]
+        return pd.MultiIndex.from_product(levels)
+
+    def query(self, by=(), stat='mean', observed=False, **filters):
+        # Mean per respondent, total or share of the consumption in every group of 'by', for the cells
+        # selected by the filters, e.g. query('AgeGroup', Gender='Female', FoodCategory=['Fish', 'Eggs']).
+        # Without 'by' the result is one Series over the categories. Like a groupby on the categorical
+        # columns, empty groups are kept with NaN means unless observed=True.
+        if stat not in statistics:
+            raise ValueError(f'Unknown statistic {stat!r}, expected one of {statistics}')
+        by, positions, sums, counts, weights = self.rollup(by, filters)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            if stat == 'mean':
+                values = sums / weights[..., None]
+            elif stat == 'share':
+                values = sums / sums.sum(axis=-1, keepdims=True)
+            else:
+                values = sums
+        columns = self.categories[positions[-1]]
+        if not by:
+            return pd.Series(values, index=columns, name=stat)
+        result = pd.DataFrame(values.reshape(-1, len(columns)), index=self.group_index(by, positions), columns=columns)
+        if observed:
+            result = result[counts.reshape(-1) > 0]
+        return result
+
+    def respondents(self, by=(), observed=False, **filters):
+        # Number of respondents in every group of 'by'
+        by, positions, sums, counts, weights = self.rollup(by, filters)
+        if not by:
+            return int(counts)
+        result = pd.Series(counts.reshape(-1), index=self.group_index(by, positions), name='Respondents')
+        return result[result > 0] if observed else result
+
+
+def build_cube(df, categories, weights=None):
+    # Cube from one row per respondent with the schema columns of CUBE_DIMENSIONS and one column of
+    # amounts per food category. Every respondent is added to its cell with one sparse product, scaled
+    # by its survey weight when weights (a column name or array) is given.
+    labels = {dimension: dimensions[dimension][0].categories for dimension in CUBE_DIMENSIONS}
+    codes = []
+    for dimension in CUBE_DIMENSIONS:
+        column = df[dimension]
+        if not isinstance(column.dtype, pd.CategoricalDtype) or column.dtype != dimensions[dimension][0]:
+            raise ValueError(f'{dimension} must be normalized to the schema dtype before building the cube')
+        if column.isna().any():
+            raise ValueError(f'{dimension} has missing labels, every respondent needs a cell')
+        codes.append(column.cat.codes.to_numpy())
+    shape = tuple(len(labels[dimension]) for dimension in CUBE_DIMENSIONS)
+    cells = np.ravel_multi_index(codes, shape)
+
+    n_cells = int(np.prod(shape))
+    if weights is None:
+        respondent_weights = np.ones(len(df))
+    else:
+        respondent_weights = (df[weights] if isinstance(weights, str) else pd.Series(weights)).to_numpy(dtype=float)
+    membership = sparse.csr_matrix((respondent_weights, (cells, np.arange(len(df)))), shape=(n_cells, len(df)))
+    amounts = df[list(categories)].to_numpy(dtype=float)
+    sums = np.asarray(membership @ amounts).reshape(shape + (len(categories),))
+    counts = np.bincount(cells, minlength=n_cells).reshape(shape)
+    cell_weights = None if weights is None else np.bincount(cells, weights=respondent_weights, minlength=n_cells).reshape(shape)
+    return ConsumptionCube(labels, categories, sums, counts, cell_weights)
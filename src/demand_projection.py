@@ -0,0 +1,196 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from schema import normalize, normalize_frame
+
+SSB_POPULATION_PATH = os.path.join(os.path.dirname(__file__), '..', 'data', 'raw', 'ssb', 'Population - age and gender.xlsx')
+SSB_TOTAL_POPULATION_PATH = os.path.join(os.path.dirname(__file__), '..', 'data', 'raw', 'ssb', 'Total population.xlsx')
+SSP_POPULATION_PATH = os.path.join(os.path.dirname(__file__), '..', 'data', 'raw', 'iiasa', 'wicdf.csv')
+
+GRAMS_PER_DAY_TO_TONNES_PER_YEAR = 365 / 1e6
+
+
+#%% Loaders
+def load_ssb_population(file_path=SSB_POPULATION_PATH):
+    # Persons by Gender and AgeGroup of the shared schema with one column per year,
+    # the SSB groups from 70 years up are summed into 70+
+    df_pop = pd.read_excel(file_path, skiprows=3, skipfooter=3)
+    df_pop.rename(columns={'Unnamed: 0': 'Gender', 'Unnamed: 1': 'AgeGroup'}, inplace=True)
+    df_pop.dropna(inplace=True)
+    df_pop.columns = [str(col) for col in df_pop.columns]
+    df_pop = normalize_frame(df_pop)
+    return df_pop.groupby(['Gender', 'AgeGroup'], observed=True).sum().reset_index()
+
+
+def load_total_population(file_path=SSB_TOTAL_POPULATION_PATH):
+    # Persons living in Norway on 1 January, indexed by year
+    df_total = pd.read_excel(file_path)
+    df_total.columns = [str(col).strip() for col in df_total.columns]
+    return df_total.set_index('Year')['Total']
+
+
+def load_ssp_population(file_path=SSP_POPULATION_PATH):
+    # Wittgenstein Centre SSP projections: Scenario, Year and Population in persons
+    with open(file_path, encoding='utf-8') as f:
+        header_row = next(i for i, line in enumerate(f) if line.startswith('"Scenario"'))
+    df_ssp = pd.read_csv(file_path, skiprows=header_row)
+    df_ssp['Population'] = df_ssp['Population'] * 1000  # The file is in thousands
+    return df_ssp[['Scenario', 'Year', 'Population']]
+
+
+#%% Demand cube
+class DemandCube:
+    # A dense array with one labelled axis per dimension. Slices and sums work on the stored
+    # array, so no demand is recomputed.
+    def __init__(self, values, coords, name='Demand (tonnes/year)'):
+        self.values = values
+        self.coords = {dim: pd.Index(labels) for dim, labels in coords.items()}
+        self.name = name
+
+    @property
+    def dims(self):
+        return tuple(self.coords)
+
+    def sel(self, **selection):
+        # A single label drops the dimension, a list of labels keeps it
+        index, coords = [], {}
+        for dim, labels in self.coords.items():
+            if dim not in selection:
+                index.append(slice(None))
+                coords[dim] = labels
+            elif np.ndim(selection[dim]) == 0:
+                index.append(labels.get_loc(selection[dim]))
+            else:
+                positions = labels.get_indexer(selection[dim])
+                if (positions < 0).any():
+                    raise KeyError(f'{selection[dim]} not all in {dim}')
+                index.append(positions)
+                coords[dim] = labels[positions]
+        # Index one axis at a time so lists on several axes select the outer product
+        values = self.values
+        axis = 0
+        for item in index:
+            if isinstance(item, (int, np.integer)):
+                values = np.take(values, item, axis=axis)
+            else:
+                values = values[(slice(None),) * axis + (item,)]
+                axis += 1
+        return DemandCube(values, coords, self.name)
+
+    def sum(self, *dims):
+        axes = tuple(self.dims.index(dim) for dim in dims)
+        coords = {dim: labels for dim, labels in self.coords.items() if dim not in dims}
+        return DemandCube(self.values.sum(axis=axes), coords, self.name)
+
+    def mean(self, *dims):
+        axes = tuple(self.dims.index(dim) for dim in dims)
+        coords = {dim: labels for dim, labels in self.coords.items() if dim not in dims}
+        return DemandCube(self.values.mean(axis=axes), coords, self.name)
+
+    def to_series(self):
+        if not self.coords:
+            return pd.Series([self.values.item()], name=self.name)
+        index = pd.MultiIndex.from_product(list(self.coords.values()), names=list(self.coords))
+        return pd.Series(self.values.ravel(), index=index, name=self.name)
+
+    def to_frame(self):
+        return self.to_series().reset_index()
+
+
+def percapita_array(df_percapita, ages, genders, categories, value_col='Average amount consumed (g)'):
+    # (age, gender, category) array of per-capita intake. Age and gender groups the survey does not cover
+    # (e.g. the children for Norkost 3, which starts at 18) are NaN, not 0, so their demand is not silently
+    # left out of the totals; a category without rows in a covered group was not eaten there and is 0.
+    df = normalize_frame(df_percapita)
+    table = df.pivot_table(index=['AgeGroup', 'Gender'], columns='FoodCategory', values=value_col, aggfunc='sum', observed=True)
+    full_index = pd.MultiIndex.from_product([ages, genders], names=['AgeGroup', 'Gender'])
+    table = table.reindex(columns=categories).fillna(0).reindex(index=full_index)
+    return table.to_numpy().reshape(len(ages), len(genders), len(categories))
+
+
+def population_demand(df_pop, df_percapita, value_cols=None):
+    # Per-capita intake times the SSB population of every year column of df_pop.
+    # The per-capita rows are joined to the population once, then all rows, years and value
+    # columns are multiplied in one product. Returns one row per year and per-capita row.
+    key_cols = ['Gender', 'AgeGroup']
+    year_cols = [col for col in df_pop.columns if col not in key_cols]
+    if value_cols is None:
+        value_cols = [col for col in df_percapita.columns if col not in key_cols + ['FoodCategory']]
+
+    df = normalize_frame(df_percapita)
+    # Population of each per-capita row, rows without an SSB group are dropped like in an inner merge
+    population = df_pop.set_index(key_cols)[year_cols]
+    positions = population.index.get_indexer(pd.MultiIndex.from_frame(df[key_cols]))
+    df = df[positions >= 0].reset_index(drop=True)
+    pop = population.to_numpy(dtype=float)[positions[positions >= 0]]
+    intake = df[value_cols].to_numpy(dtype=float)
+
+    demand = np.einsum('ry,rv->yrv', pop, intake).reshape(-1, len(value_cols))
+    keys = df[key_cols + ['FoodCategory']]
+    df_demand = pd.concat([keys] * len(year_cols), ignore_index=True)
+    df_demand.insert(0, 'Year', np.repeat(year_cols, len(df)))
+    df_demand[value_cols] = demand
+    return df_demand
+
+
+def project_ssp_population(df_ssp, df_pop, base_year=None):
+    # Population cube scenario x year x age x gender. The SSP totals are split over age and gender
+    # with the SSB structure of base_year (the latest SSB year by default).
+    year_cols = [col for col in df_pop.columns if col not in ('Gender', 'AgeGroup')]
+    base_year = str(base_year or year_cols[-1])
+
+    structure = df_pop.pivot_table(index='AgeGroup', columns='Gender', values=base_year, aggfunc='sum', observed=True)
+    shares = structure.to_numpy() / structure.to_numpy().sum()
+    totals = df_ssp.pivot_table(index='Scenario', columns='Year', values='Population', aggfunc='sum')
+
+    values = np.einsum('sy,ag->syag', totals.to_numpy(), shares)
+    return DemandCube(values, {
+        'scenario': totals.index,
+        'year': totals.columns,
+        'age': structure.index,
+        'gender': structure.columns,
+    }, name='Population')
+
+
+def population_history(df_pop, ssp_population, scenario):
+    # Year x age x gender cube of the SSB years followed by the projected years of one SSP scenario
+    # after the last SSB year, with integer years
+    year_cols = [col for col in df_pop.columns if col not in ('Gender', 'AgeGroup')]
+    ages, genders = ssp_population.coords['age'], ssp_population.coords['gender']
+    observed = df_pop.pivot_table(index=['AgeGroup', 'Gender'], values=year_cols, aggfunc='sum', observed=True)
+    observed = observed.reindex(pd.MultiIndex.from_product([ages, genders]), fill_value=0)[year_cols]
+    history = observed.to_numpy(dtype=float).T.reshape(len(year_cols), len(ages), len(genders))
+
+    projected = ssp_population.sel(scenario=scenario)
+    later = np.asarray(projected.coords['year']) > int(year_cols[-1])
+    years = [int(year) for year in year_cols] + [int(year) for year in projected.coords['year'][later]]
+    values = np.concatenate([history, projected.values[later]])
+    return DemandCube(values, {'year': years, 'age': ages, 'gender': genders}, name='Population')
+
+
+def project_ssp_demand(df_ssp, df_pop, surveys, base_year=None, value_col='Average amount consumed (g)'):
+    # Demand cube survey x scenario x year x age x gender x food category in tonnes per year: the projected
+    # population of project_ssp_population multiplied by the per-capita intake of every survey in one einsum.
+    # surveys maps the survey name to its per-capita table, e.g. {'NK2': df_nk2, 'NK3': df_nk3}. The
+    # categories are those of all surveys, a category a survey has no data for is NaN for that survey.
+    # The age and gender groups a survey does not cover are NaN as well, so a sum over the ages is NaN
+    # unless it is restricted to the covered groups, e.g. with sel(age=...) or with covered_ages.
+    population = project_ssp_population(df_ssp, df_pop, base_year)
+    ages, genders = population.coords['age'], population.coords['gender']
+    labels = {name: normalize(df['FoodCategory'], 'FoodCategory') for name, df in surveys.items()}
+    categories = pd.concat(labels.values()).cat.remove_unused_categories().cat.categories
+    intake = np.stack([percapita_array(df, ages, genders, categories, value_col) for df in surveys.values()])
+    for i, survey_labels in enumerate(labels.values()):
+        intake[i][..., ~categories.isin(survey_labels)] = np.nan
+
+    values = np.einsum('syag,xagc->xsyagc', population.values, intake) * GRAMS_PER_DAY_TO_TONNES_PER_YEAR
+    return DemandCube(values, {'survey': list(surveys), **population.coords, 'category': categories})
+
+
+def covered_ages(demand):
+    # Age groups with demand of every survey, gender and category, the part of a demand cube that sums
+    # to a complete total
+    values = np.moveaxis(demand.values, demand.dims.index('age'), 0)
+    return list(demand.coords['age'][~np.isnan(values.reshape(len(values), -1)).any(axis=1)])
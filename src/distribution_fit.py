@@ -0,0 +1,111 @@
+import numpy as np
+import pandas as pd
+from scipy import special, stats
+
+# Candidate distributions, lognormal and gamma are fitted with the location fixed at 0 like stats.<dist>.fit(x, floc=0)
+DISTRIBUTIONS = ('norm', 'lognorm', 'gamma')
+
+
+#%% Per-group maximum likelihood estimates from sums over the sorted rows
+def group_sums(values, starts):
+    return np.add.reduceat(values, starts) if len(values) else np.zeros(0)
+
+
+def fit_norm(x, log_x, starts, counts, rows):
+    mean = group_sums(x, starts) / counts
+    scale = np.sqrt(group_sums((x - mean[rows]) ** 2, starts) / counts)
+    loglik = -counts / 2 * (np.log(2 * np.pi * scale ** 2) + 1)
+    return {'shape': np.full(len(counts), np.nan), 'loc': mean, 'scale': scale}, loglik
+
+
+def fit_lognorm(x, log_x, starts, counts, rows):
+    mu = group_sums(log_x, starts) / counts
+    sigma = np.sqrt(group_sums((log_x - mu[rows]) ** 2, starts) / counts)
+    loglik = -group_sums(log_x, starts) - counts / 2 * (np.log(2 * np.pi * sigma ** 2) + 1)
+    return {'shape': sigma, 'loc': np.zeros(len(counts)), 'scale': np.exp(mu)}, loglik
+
+
+def fit_gamma(x, log_x, starts, counts, rows, iterations=8):
+    mean = group_sums(x, starts) / counts
+    mean_log = group_sums(log_x, starts) / counts
+    s = np.log(mean) - mean_log
+    # Closed-form starting value followed by Newton steps on log(k) - digamma(k) = s
+    k = (3 - s + np.sqrt((s - 3) ** 2 + 24 * s)) / (12 * s)
+    for _ in range(iterations):
+        k = k - (np.log(k) - special.digamma(k) - s) / (1 / k - special.polygamma(1, k))
+    scale = mean / k
+    loglik = (k - 1) * group_sums(log_x, starts) - group_sums(x, starts) / scale - counts * (k * np.log(scale) + special.gammaln(k))
+    return {'shape': k, 'loc': np.zeros(len(counts)), 'scale': scale}, loglik
+
+
+fit_functions = {
+    'norm': fit_norm,
+    'lognorm': fit_lognorm,
+    'gamma': fit_gamma,
+}
+
+
+def row_cdf(distribution, x, params, rows):
+    # CDF of every row under the parameters of its own group
+    loc, scale = params['loc'][rows], params['scale'][rows]
+    if distribution == 'norm':
+        return stats.norm.cdf(x, loc, scale)
+    return getattr(stats, distribution).cdf(x, params['shape'][rows], loc, scale)
+
+
+#%% Fit every distribution to every group in one pass over the rows sorted by group code
+def fit_group_distributions(df, group_cols, value_col, distributions=DISTRIBUTIONS):
+    data = df[group_cols + [value_col]].dropna()
+    grouped = data.groupby(group_cols, sort=True, observed=True)
+    codes = grouped.ngroup().to_numpy()
+    groups = grouped.size().index
+
+    # Sort by group code and by value inside each group, so sums and the KS statistic are
+    # segment reductions over contiguous slices
+    values = data[value_col].to_numpy(dtype=float)
+    order = np.lexsort((values, codes))
+    x, rows = values[order], codes[order]
+    counts = np.bincount(rows, minlength=len(groups)).astype(float)
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]]).astype(int)
+    rank = np.arange(len(x)) - starts[rows]
+
+    positive = np.minimum.reduceat(x, starts) > 0 if len(x) else np.zeros(0, dtype=bool)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        log_x = np.log(np.where(x > 0, x, np.nan))
+
+        tables = []
+        for distribution in distributions:
+            params, loglik = fit_functions[distribution](x, log_x, starts, counts, rows)
+            cdf = row_cdf(distribution, x, params, rows)
+            ks = np.maximum(
+                np.maximum.reduceat((rank + 1) / counts[rows] - cdf, starts),
+                np.maximum.reduceat(cdf - rank / counts[rows], starts),
+            ) if len(x) else np.zeros(0)
+
+            table = groups.to_frame(index=False)
+            table['Distribution'] = distribution
+            table['Observations'] = counts.astype(int)
+            table['Min'] = x[starts] if len(x) else np.zeros(0)
+            table['Max'] = np.maximum.reduceat(x, starts) if len(x) else np.zeros(0)
+            table['shape'] = params['shape']
+            table['loc'] = params['loc']
+            table['scale'] = params['scale']
+            table['LogLikelihood'] = loglik
+            table['AIC'] = 2 * 2 - 2 * loglik
+            table['KS'] = ks
+            if distribution != 'norm':
+                # Lognormal and gamma are only defined for positive values
+                table.loc[~positive, ['shape', 'scale', 'LogLikelihood', 'AIC', 'KS']] = np.nan
+            tables.append(table)
+
+    fits = pd.concat(tables, ignore_index=True)
+    fits = fits.replace([np.inf, -np.inf], np.nan)
+    fits['Best'] = fits['AIC'] == fits.groupby(group_cols, observed=True)['AIC'].transform('min')
+    return fits.sort_values(group_cols + ['Distribution']).reset_index(drop=True)
+
+
+def fitted_pdf(fit, x):
+    # Density of one row of the fit table
+    if fit['Distribution'] == 'norm':
+        return stats.norm.pdf(x, fit['loc'], fit['scale'])
+    return getattr(stats, fit['Distribution']).pdf(x, fit['shape'], fit['loc'], fit['scale'])
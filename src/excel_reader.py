@@ -0,0 +1,146 @@
+import posixpath
+import zipfile
+from itertools import islice
+from xml.etree.ElementTree import iterparse, parse
+
+import pandas as pd
+
+# The sheets are read straight from the XML in the .xlsx archive. Only the cells of the selected
+# columns are converted to values, the other cells of a row are skipped on their reference.
+# Cell styles are not read, so date cells come back as Excel serial numbers.
+MAIN_NS = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+REL_NS = '{http://schemas.openxmlformats.org/officeDocument/2006/relationships}'
+PACKAGE_REL_NS = '{http://schemas.openxmlformats.org/package/2006/relationships}'
+
+def column_number(letters):
+    # Zero-based column of the letters of a cell reference, 'AB' for 'AB12'
+    number = 0
+    for letter in letters:
+        number = number * 26 + ord(letter) - 64
+    return number - 1
+
+
+def column_letters(number):
+    letters = ''
+    number += 1
+    while number:
+        number, remainder = divmod(number - 1, 26)
+        letters = chr(65 + remainder) + letters
+    return letters
+
+
+def sheet_paths(archive):
+    # Sheet name to the path of its XML part in the archive
+    rels = parse(archive.open('xl/_rels/workbook.xml.rels')).getroot()
+    targets = {rel.get('Id'): rel.get('Target') for rel in rels.iter(f'{PACKAGE_REL_NS}Relationship')}
+    workbook = parse(archive.open('xl/workbook.xml')).getroot()
+    paths = {}
+    for sheet in workbook.iter(f'{MAIN_NS}sheet'):
+        target = targets[sheet.get(f'{REL_NS}id')]
+        paths[sheet.get('name')] = target.lstrip('/') if target.startswith('/') else posixpath.normpath(posixpath.join('xl', target))
+    return paths
+
+
+def shared_strings(archive):
+    if 'xl/sharedStrings.xml' not in archive.namelist():
+        return []
+    # Cells refer to the strings by their position, so all of them are kept, but only as text: every
+    # finished <si> is removed from the tree
+    strings = []
+    events = iterparse(archive.open('xl/sharedStrings.xml'), events=('start', 'end'))
+    _, root = next(events)
+    for event, elem in events:
+        if event == 'end' and elem.tag == f'{MAIN_NS}si':
+            strings.append(''.join(text.text or '' for text in elem.iter(f'{MAIN_NS}t')))
+            root.clear()
+    return strings
+
+
+def cell_value(cell, strings):
+    cell_type = cell.get('t')
+    if cell_type == 'inlineStr':
+        return ''.join(text.text or '' for text in cell.iter(f'{MAIN_NS}t'))
+    value = cell.find(f'{MAIN_NS}v')
+    if value is None or value.text is None:
+        return None
+    if cell_type == 's':
+        return strings[int(value.text)]
+    if cell_type == 'b':
+        return value.text == '1'
+    if cell_type in ('str', 'e'):
+        return value.text
+    number = float(value.text)
+    return int(number) if number.is_integer() and '.' not in value.text and 'E' not in value.text.upper() else number
+
+
+def sheet_rows(archive, path, strings, wanted=None):
+    # Row by row, a dict of column number to value. With wanted (a set of column numbers) a cell is
+    # only converted when the letters of its reference are those of a wanted column.
+    # Every row is removed from <sheetData> once its values are read, so the tree holds one row at a time. The
+    # parser still builds the elements of every cell, so the parse time grows with the width of the
+    # sheet, only the conversion is limited to the wanted columns.
+    wanted_letters = None if wanted is None else {column_letters(column): column for column in wanted}
+    events = iterparse(archive.open(path), events=('start', 'end'))
+    for event, elem in events:
+        if event == 'start' and elem.tag == f'{MAIN_NS}sheetData':
+            sheet_data = elem
+            break
+    else:
+        return
+    for event, row in events:
+        if event == 'start' or row.tag != f'{MAIN_NS}row':
+            continue
+        values = {}
+        for position, cell in enumerate(row.iter(f'{MAIN_NS}c')):
+            reference = cell.get('r')
+            letters = reference.rstrip('0123456789') if reference else column_letters(position)
+            if wanted_letters is None:
+                values[column_number(letters)] = cell_value(cell, strings)
+            elif letters in wanted_letters:
+                values[wanted_letters[letters]] = cell_value(cell, strings)
+        sheet_data.remove(row)
+        yield values
+
+
+# Find the header in the first rows of a sheet. The header is the first row that
+# contains the key column and every requested column.
+def find_header(rows, header_key, columns, max_header_rows):
+    for row_number, row in enumerate(rows, start=1):
+        if row_number > max_header_rows:
+            break
+        labels = {column: str(value).strip() for column, value in row.items() if value is not None}
+        if header_key in labels.values() and all(col in labels.values() for col in columns or []):
+            return row_number, labels
+    raise ValueError(f"No header row with '{header_key}' and {columns} in the first {max_header_rows} rows")
+
+
+def read_columns(archive, path, strings, columns=None, header_key='Nr', max_header_rows=20):
+    # The header rows are read whole, after the header only the cells of the selected columns
+    header_rows = sheet_rows(archive, path, strings)
+    header_row, labels = find_header(header_rows, header_key, columns, max_header_rows)
+    header_rows.close()
+    if columns is None:
+        columns = [labels[column] for column in sorted(labels)]
+    positions = {label: column for column, label in sorted(labels.items(), reverse=True)}
+    selected = [positions[col] for col in columns]
+
+    rows = islice(sheet_rows(archive, path, strings, wanted=set(selected)), header_row, None)
+    values = {col: [] for col in columns}
+    for row in rows:
+        if not row or all(value is None for value in row.values()):
+            continue
+        for col, column in zip(columns, selected):
+            values[col].append(row.get(column))
+    return pd.DataFrame(values, columns=columns)
+
+
+# Read several sheets while opening the workbook only once.
+# sheet_columns maps each sheet name to the list of columns to keep (None keeps every column).
+def read_sheets(file_path, sheet_columns, header_key='Nr', max_header_rows=20):
+    with zipfile.ZipFile(file_path) as archive:
+        paths = sheet_paths(archive)
+        strings = shared_strings(archive)
+        return {
+            sheet_name: read_columns(archive, paths[sheet_name], strings, columns, header_key, max_header_rows)
+            for sheet_name, columns in sheet_columns.items()
+        }
@@ -0,0 +1,158 @@
+import hashlib
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import matplotlib
+import matplotlib.pyplot as plt
+import numpy as np
+import pandas as pd
+import seaborn as sns
+
+# A figure spec is a plain dict with the 'kind' of figure, a unique 'name' used as the file name,
+# the 'title', 'xlabel' and 'ylabel', and the data needed by the drawing function of that kind.
+MANIFEST_NAME = 'manifest.json'
+# Backends that draw into files only, plt.show() cannot display their figures
+NON_INTERACTIVE_BACKENDS = ('agg', 'cairo', 'pdf', 'pgf', 'ps', 'svg', 'template')
+
+
+#%% Drawing functions for each kind of figure
+def draw_category_lines(ax, spec):
+    sns.lineplot(data=spec['data'], x=spec['x'], y=spec['y'], hue=spec.get('hue'), style=spec.get('style'), markers=True, ax=ax)
+
+
+def draw_fitted_pdf(ax, spec):
+    ax.plot(spec['x'], spec['y'], label=spec['label'])
+    ax.legend()
+
+
+def draw_polynomial_fit(ax, spec):
+    ax.plot(spec['observed_x'], spec['observed_y'], 'bo', label='Observed Data')
+    ax.plot(spec['predicted_x'], spec['predicted_y'], 'r-', label='Polynomial Fit')
+    ax.legend()
+
+
+figure_kinds = {
+    'category_lines': draw_category_lines,
+    'fitted_pdf': draw_fitted_pdf,
+    'polynomial_fit': draw_polynomial_fit,
+}
+
+
+def draw_figure(spec):
+    fig, ax = plt.subplots(figsize=spec.get('figsize', (10, 6)))
+    figure_kinds[spec['kind']](ax, spec)
+    ax.set_title(spec['title'])
+    ax.set_xlabel(spec['xlabel'])
+    ax.set_ylabel(spec['ylabel'])
+    ax.grid(True)
+    return fig
+
+
+#%% Content hash of a spec, so unchanged figures are not rendered again
+def update_digest(digest, value):
+    if isinstance(value, pd.DataFrame):
+        digest.update(json.dumps(list(map(str, value.columns))).encode())
+        digest.update(pd.util.hash_pandas_object(value, index=False).values.tobytes())
+    elif isinstance(value, pd.Series):
+        digest.update(pd.util.hash_pandas_object(value, index=False).values.tobytes())
+    elif isinstance(value, np.ndarray):
+        digest.update(str((value.dtype, value.shape)).encode())
+        digest.update(np.ascontiguousarray(value).tobytes())
+    elif isinstance(value, dict):
+        for key in sorted(value):
+            digest.update(str(key).encode())
+            update_digest(digest, value[key])
+    elif isinstance(value, (list, tuple)):
+        for item in value:
+            update_digest(digest, item)
+    else:
+        digest.update(repr(value).encode())
+
+
+def spec_hash(spec):
+    digest = hashlib.sha256()
+    update_digest(digest, spec)
+    return digest.hexdigest()
+
+
+def figure_name(*parts):
+    # File name built from the labels of a figure, e.g. ('regression', '10-19', 'Male')
+    return '_'.join(str(part).replace(' ', '-').replace('/', '-') for part in parts)
+
+
+def figure_paths(spec, out_dir, formats):
+    return [os.path.join(out_dir, f"{spec['name']}.{fmt}") for fmt in formats]
+
+
+#%% Batch rendering
+def render_figure(spec, out_dir, formats, dpi):
+    # Runs in a worker process, so only the non-interactive backend is used
+    matplotlib.use('Agg')
+    fig = draw_figure(spec)
+    fig.tight_layout()
+    for path in figure_paths(spec, out_dir, formats):
+        fig.savefig(path, dpi=dpi)
+    plt.close(fig)
+    return spec['name']
+
+
+def write_manifest(manifest, path):
+    # Written to a temporary file first, so a crash while writing does not leave a broken manifest
+    with open(path + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(path + '.tmp', path)
+
+
+def render_figures(specs, out_dir, formats=('png',), processes=None, dpi=100):
+    os.makedirs(out_dir, exist_ok=True)
+    manifest_path = os.path.join(out_dir, MANIFEST_NAME)
+    manifest = {}
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+
+    # Skip figures whose spec has the same hash as the rendered files
+    hashes = {spec['name']: spec_hash({'spec': spec, 'dpi': dpi}) for spec in specs}
+    if len(hashes) != len(specs):
+        raise ValueError('Figure names must be unique')
+    todo = [
+        spec for spec in specs
+        if manifest.get(spec['name']) != hashes[spec['name']]
+        or not all(os.path.exists(path) for path in figure_paths(spec, out_dir, formats))
+    ]
+
+    # The manifest is written after every rendered figure, so an interrupted or failed batch keeps the
+    # figures it finished. A failed figure does not stop the others, its error is raised at the end.
+    rendered, errors = [], []
+    if todo:
+        with ProcessPoolExecutor(max_workers=processes) as pool:
+            futures = {pool.submit(render_figure, spec, out_dir, formats, dpi): spec['name'] for spec in todo}
+            for future in as_completed(futures):
+                try:
+                    name = future.result()
+                except Exception as error:
+                    errors.append((futures[future], error))
+                    continue
+                manifest[name] = hashes[name]
+                rendered.append(name)
+                write_manifest(manifest, manifest_path)
+    write_manifest(manifest, manifest_path)
+    if errors:
+        name, error = errors[0]
+        raise RuntimeError(f"{len(errors)} figures failed to render, the first is '{name}'") from error
+    print(f'Rendered {len(rendered)} figures, {len(specs) - len(rendered)} unchanged, in {out_dir}')
+    return rendered
+
+
+def interactive_backend():
+    return matplotlib.get_backend().lower() not in NON_INTERACTIVE_BACKENDS
+
+
+def show_figures(specs):
+    # Interactive mode, one figure after another. Every figure is closed once its window is, so pyplot
+    # does not keep them all open.
+    for spec in specs:
+        fig = draw_figure(spec)
+        plt.show()
+        plt.close(fig)
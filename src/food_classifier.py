@@ -0,0 +1,67 @@
+import re
+
+import numpy as np
+import pandas as pd
+
+# Rules that move items to another category by keywords in the item name. A rule applies to the
+# items of 'category' (None for every item); the first applicable rule that matches wins.
+# Keywords are matched case-insensitively anywhere in the name.
+classification_rules = [
+    {
+        'name': 'poultry',
+        'category': 'Red meat',
+        'keywords': ['chicken', 'poultry', 'turkey', 'hen', 'duck'],
+        'target': 'Poultry'
+    },
+]
+
+
+def compile_rules(rules):
+    # One alternation of the keywords of all rules and the rules of every keyword. The alternation sits
+    # in a lookahead, so one findall scans a name once and returns every keyword at every position,
+    # overlapping ones included, in the order they occur. Longer keywords come first at a position.
+    keyword_rules = {}
+    for i, rule in enumerate(rules):
+        for keyword in rule['keywords']:
+            keyword_rules.setdefault(keyword.lower(), []).append(i)
+    keywords = sorted(keyword_rules, key=len, reverse=True)
+    pattern = re.compile(f"(?=({'|'.join(re.escape(keyword) for keyword in keywords)}))")
+    matches = pd.DataFrame(
+        [(keyword, i) for keyword, indices in keyword_rules.items() for i in indices],
+        columns=['Keyword', 'Rule'],
+    )
+    return pattern, matches
+
+
+def rule_keywords(names, rules):
+    # (names x rules) array with the first keyword of every rule found in each name, None without a match
+    pattern, keyword_rules = compile_rules(rules)
+    found = pd.Series(names).str.lower().str.findall(pattern).explode().dropna()
+    found = pd.DataFrame({'Name': found.index.to_numpy(), 'Keyword': found.to_numpy()})
+    found = found.merge(keyword_rules, on='Keyword', how='left').drop_duplicates(['Name', 'Rule'])
+    keywords = np.full((len(names), len(rules)), None, dtype=object)
+    keywords[found['Name'].to_numpy(dtype=int), found['Rule'].to_numpy(dtype=int)] = found['Keyword'].to_numpy()
+    return keywords
+
+
+def classify_items(names, categories, rules=classification_rules):
+    # New category, matched rule and keyword for every item. Every distinct name is scanned once for the
+    # keywords of all rules; the rule choice is an array operation over items x rules.
+    names = pd.Series(names)
+    categories = pd.Series(categories, index=names.index)
+    codes, unique_names = pd.factorize(names.fillna(''))
+    keywords = rule_keywords(unique_names, rules)[codes]
+
+    rule_categories = np.array([rule['category'] for rule in rules], dtype=object)
+    applies = (rule_categories[None, :] == None) | (categories.to_numpy()[:, None] == rule_categories[None, :])  # noqa: E711
+    hits = applies & pd.notna(keywords)
+    matched = hits.any(axis=1)
+    first = hits.argmax(axis=1)
+
+    rule_names = np.array([rule['name'] for rule in rules], dtype=object)
+    targets = np.array([rule['target'] for rule in rules], dtype=object)
+    return pd.DataFrame({
+        'Category': np.where(matched, targets[first], categories.to_numpy()),
+        'Rule': np.where(matched, rule_names[first], None),
+        'Keyword': np.where(matched, keywords[np.arange(len(names)), first], None),
+    }, index=names.index)
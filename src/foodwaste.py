@@ -1,88 +1,36 @@
 #%%
 import pandas as pd
+import numpy as np
 import os
 import matplotlib.pyplot as plt
+from demand_projection import load_ssb_population
+from schema import normalize_frame
+from waste_flow import STAGES, WasteFlowModel, household_consumption, load_stage_waste
+
+# Step 1: Waste of every stage and year in the study categories
+# The sheets of matsvinn.xlsx are summed into the study categories with the compiled food waste mapping.
+# The household sheet is kg per household, it is scaled with the SSB population of each year
+# (two persons per household).
+df_waste = load_stage_waste()
+years = df_waste.coords['year']
+categories = df_waste.coords['category']
 
-# Step 1: Read the data from Excel
-# Construct the file path using os.path.join for better compatibility across different operating systems
-current_directory = os.path.dirname(__file__)
-file_path = os.path.join(current_directory, '..', 'data', 'raw', 'matsvinn', 'matsvinn.xlsx')
-df = pd.read_excel(file_path, sheet_name=None)  # Load all sheets into a dictionary
-
-# Assuming the sheet names are 'Food Industry', 'Wholesaler', 'Retailer', 'Household'
-df_food_industry = df['Food Industry']
-df_wholesaler = df['Wholesaler']
-df_retailer = df['Retailer']
-df_household = df['Household']
 #%%
-# Step 2: Category mapping based on the provided final categories
-category_mapping = {
-    'Bakervarer': 'Grains and cereals',
-    'Langtidsholdbart': 'Miscellaneous',
-    'Drikkevarer': 'Beverages',
-    'Frisk frukt og grønt': 'Vegetables',
-    'Meierivarer': 'Dairy and alternatives',
-    'Egg': 'Eggs',
-    'Frossen mat': 'Miscellaneous',
-    'Ferdigmat og deli': 'Miscellaneous',
-    'Kjøttvarer': 'Red meat',
-    'Øvrig': 'Miscellaneous',
-    'Gryte- og tallerkenrester': 'Miscellaneous',  # From household data
-    'Diverse rester': 'Miscellaneous',  # From household data
-    'Brød og andre bakervarer': 'Grains and cereals',  # From household data
-    'Meieriprodukter': 'Dairy and alternatives',  # From household data
-    'Kjøtt': 'Red meat',  # From household data
-    'Fisk': 'Fish',  # From household data
-    'Frukt og grønnsaker': 'Vegetables'  # From household data
-}
-
-# Step 4: Calculate the average across the years for each stage
-def calculate_avg_by_category(df, category_mapping):
-    # Map the columns to the relevant categories
-    df_mapped = df.rename(columns=category_mapping)
-    
-    # Ensure that all columns are numeric
-    df_mapped = df_mapped.apply(pd.to_numeric, errors='coerce')
-    
-    # Calculate the average across the years (excluding 'Year' if it exists)
-    df_avg = df_mapped.mean(axis=0)
-    
-    return df_avg
-
-# Calculate the average for each stage
-df_food_industry_avg = calculate_avg_by_category(df_food_industry, category_mapping)
-df_wholesaler_avg = calculate_avg_by_category(df_wholesaler, category_mapping)
-df_retailer_avg = calculate_avg_by_category(df_retailer, category_mapping)
+# Step 2: Loss factor model of the supply chain
+# What households eat is the NK3 per-capita intake scaled to the population of each year. Every stage
+# wastes a share of its inflow and passes the rest on: Food Industry -> Wholesaler -> Retailer -> Household.
+folder_path = os.path.join(os.path.dirname(__file__), '..', 'data', 'auxiliary')
+df_nk3 = normalize_frame(pd.read_excel(os.path.join(folder_path, 'average percapita consumption_nk3.xlsx')))
+df_consumption = household_consumption(load_ssb_population(), df_nk3, years, categories)
+model = WasteFlowModel(df_waste, df_consumption)
+
+df_loss = pd.DataFrame(model.loss.mean(axis=1).T, index=categories, columns=STAGES)
+print('Average share of the inflow wasted at each stage')
+print(df_loss.round(3))
 
-# Reshape the household data (assuming it's structured differently)
-df_household_cleaned = df_household.set_index('Type Mat').T  # Transpose the data
-df_household_grouped = df_household_cleaned.rename(columns=category_mapping)
-
-# Step 5: Remove total/aggregate columns and adjust household data for total population
-df_household_grouped = df_household_grouped.loc[:, ~df_household_grouped.columns.str.contains('|'.join(columns_to_remove), case=False)]
-population_of_norway = 5_367_580  # Approximate population of Norway
-households_in_norway = population_of_norway / 2  # Two people per household
-df_household_grouped = df_household_grouped.sum() * households_in_norway / 1_000  # Convert kg to tons
 #%%
-# Start with the Food Industry as the base DataFrame
-df_combined_avg = df_food_industry_avg.to_frame(name='Food Industry')
-
-# Join with Wholesaler data
-df_combined_avg = df_combined_avg.join(df_wholesaler_avg.to_frame(name='Wholesaler'), how='outer')
-
-# Join with Retailer data
-df_combined_avg = df_combined_avg.join(df_retailer_avg.to_frame(name='Retailer'), how='outer')
-
-# Join with Household data
-df_combined_avg = df_combined_avg.join(df_household_grouped.to_frame(name='Household'), how='outer')
-
-#Fill na with 0
-df_combined_avg.fillna(0, inplace=True)
-
-# Drop the rows 'Total Waste (tons)' and 'Year'
-df_combined_avg.drop(index=['Total Waste (tons)', 'Year'], inplace=True, errors='ignore')
-# Drop rows with duplicate index names
-df_combined_avg = df_combined_avg[~df_combined_avg.index.duplicated(keep='first')]
+# Step 3: Average waste per stage and category over the years
+df_combined_avg = df_waste.mean('year').to_series().unstack('stage')[STAGES]
 
 #%%
 # Step 6: Plot the data as a stacked bar chart
@@ -112,4 +60,27 @@ ax.legend(title='Food Category', bbox_to_anchor=(1.05, 1), loc='upper left')
 # Show plot
 plt.tight_layout()
 plt.show()
+
+#%%
+# Step 7: Waste reduction scenarios
+# Every combination of 0-50 % lower loss factors at the retailers and in the households, evaluated in one
+# batched call. The supply entering the chain is kept, so the saved waste reaches the plates.
+reduction_levels = np.linspace(0, 0.5, 51)
+retail_reduction, household_reduction = np.meshgrid(reduction_levels, reduction_levels, indexing='ij')
+reductions = np.zeros((retail_reduction.size, len(STAGES)))
+reductions[:, STAGES.index('Retailer')] = retail_reduction.ravel()
+reductions[:, STAGES.index('Household')] = household_reduction.ravel()
+_, scenario_waste, _ = model.scenarios(reductions)
+
+# Average total waste over the years for every scenario
+total_waste = scenario_waste.sum('stage', 'category').mean('year').values.reshape(retail_reduction.shape)
+
+fig, ax = plt.subplots(figsize=(10, 8))
+contours = ax.contourf(household_reduction * 100, retail_reduction * 100, total_waste, levels=20, cmap='viridis')
+fig.colorbar(contours, ax=ax, label='Average Food Waste (tons)')
+ax.set_xlabel('Reduction of household losses (%)')
+ax.set_ylabel('Reduction of retail losses (%)')
+ax.set_title('Total Food Waste under Retail and Household Reduction Scenarios')
+plt.tight_layout()
+plt.show()
 # %%
@@ -0,0 +1,316 @@
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from schema import FOOD_CATEGORIES
+
+# Categories of the study, in the order used for colours and plots
+study_categories = FOOD_CATEGORIES
+# The SSB trade statistics only separate coarser groups
+known_categories = study_categories + ['Meat', 'Dairy and eggs', 'Vegetables and Fruits']
+
+#%% Mappings from source labels to study categories
+# Food waste by stage (matsvinn.xlsx), the last labels are from the household sheet
+foodwaste_mapping = {
+    'Bakervarer': 'Grains and cereals',
+    'Fisk': 'Fish',
+    'Langtidsholdbart': 'Miscellaneous',
+    'Drikkevarer': 'Beverages',
+    'Frisk frukt og grønt': 'Vegetables',
+    'Meierivarer': 'Dairy and alternatives',
+    'Egg': 'Eggs',
+    'Frossen mat': 'Miscellaneous',
+    'Ferdigmat og deli': 'Miscellaneous',
+    'Kjøttvarer': 'Red meat',
+    'Øvrig': 'Miscellaneous',
+    'Gryte- og tallerkenrester': 'Miscellaneous',
+    'Diverse rester': 'Miscellaneous',
+    'Brød og andre bakervarer': 'Grains and cereals',
+    'Meieriprodukter': 'Dairy and alternatives',
+    'Kjøtt': 'Red meat',
+    'Frukt og grønnsaker': 'Vegetables'
+}
+
+# SSB imports and exports of food by SITC division
+trade_mapping = {
+    '00 Live animals other than animals of div.03': 'Meat',
+    '01 Meat and meat preparations': 'Meat',
+    "02 Dairy products and birds' eggs": 'Dairy and eggs',
+    '03 Fish, crustaceans, molluscs and prep. thereof': 'Fish',
+    '04 Cereals and cereal preparations': 'Grains and cereals',
+    '05 Vegetables and fruit': 'Vegetables and Fruits',
+    '06 Sugars, sugar preparations and honey': 'Sweets and snacks',
+    '07 Coffee, tea, cocoa, spices': 'Miscellaneous',
+    '09 Miscellaneous edible products': 'Miscellaneous',
+    '11 Beverages': 'Beverages',
+    '22 Oil seeds and oleaginous fruits': 'Fats and oils',
+    '42 Fixed vegetable fats and oils, crude, refined or fractionated': 'Fats and oils',
+    '43 Animal or vegetable fats and oils, processed': 'Fats and oils'
+}
+
+# Main categories of the Matvaretabell, poultry is separated from 'Meat and poultry' by item name
+matvaretabell_mapping = {
+    'Fruit and berries': 'Fruits and nuts',
+    'Nuts and seeds': 'Fruits and nuts',
+    'Vegetables': 'Vegetables',
+    'Potatoes': 'Starchy vegetables',
+    'Cereals, bread and cakes': 'Grains and cereals',
+    'Dairy products': 'Dairy and alternatives',
+    'Meat and poultry': 'Red meat',
+    'Egg': 'Eggs',
+    'Fish and shellfish': 'Fish',
+    'Legumes': 'Legumes',
+    'Herbs and spices': 'Miscellaneous',
+    'Sugar and sweet products': 'Sweets and snacks',
+    'Beverages': 'Beverages',
+    'Other foods and dishes': 'Miscellaneous',
+    'Cooking fat': 'Fats and oils',
+    'Infant food': 'Miscellaneous'
+}
+
+# Helsedirektoratet national consumption (Utviklingen i norsk kosthold)
+national_consumption_mapping = {
+    'Korn, som mel': 'Grains and cereals',  # Grain products
+    'Ris, gryn og mel': 'Grains and cereals',  # Rice, grains, and flour
+    'Poteter, friske': 'Starchy vegetables',  # Fresh potatoes
+    'Potetprodukter': 'Starchy vegetables',  # Potato products (processed)
+    'Potetmel': 'Starchy vegetables',  # Potato starch
+    'Sukker/sukkervarer': 'Sweets and snacks',  # Sugar and confectionery
+    'Erter/nøtter/kakao': 'Legumes',  # Peas, nuts, and cocoa (mainly focusing on peas and nuts)
+    'Kakaoprodukter': 'Sweets and snacks',  # Cocoa products (e.g., chocolate)
+    'Grønnsaker': 'Vegetables',  # Vegetables
+    'Frukt og bær': 'Fruits and nuts',  # Fruits and berries
+    'Kjøtt': 'Red meat',  # Meat (generic, includes red meat)
+    'Kjøttbiprodukter': 'Red meat',  # Meat by-products (assumed to be from red meat)
+    'Egg': 'Eggs',  # Eggs
+    'Fisk': 'Fish',  # Fish
+    'Helmelk': 'Dairy and alternatives',  # Whole milk
+    'Lettmelk': 'Dairy and alternatives',  # Low-fat milk
+    'Skummet melk': 'Dairy and alternatives',  # Skimmed milk
+    'Yoghurt': 'Dairy and alternatives',  # Yogurt
+    'Melkeprodukter': 'Dairy and alternatives',  # Dairy products
+    'Fløte, rømme (38%)': 'Dairy and alternatives',  # Cream and sour cream (38% fat)
+    'Ost': 'Dairy and alternatives',  # Cheese
+    'Smør': 'Fats and oils',  # Butter
+    'Margarin': 'Fats and oils',  # Margarine
+    'Herav lettmargarin': 'Fats and oils',  # Light margarine
+    'Annet fett': 'Fats and oils',  # Other fats (unspecified)
+    'Uspesifisert handel': 'Miscellaneous',  # Unspecified trade
+    'Grensehandel': 'Miscellaneous'  # Border trade (unspecified)
+}
+
+# Helsedirektoratet consumption per person
+individual_consumption_mapping = {
+    'Korn, som mel (inkl. ris)': 'Grains and cereals',
+    'Matpoteter': 'Starchy vegetables',
+    'Poteter til bearbeiding': 'Starchy vegetables',
+    'Poteter til potetprodukter': 'Starchy vegetables',
+    'Grønnsaker': 'Vegetables',
+    'Frukt og bær': 'Fruits and nuts',
+    'Kjøtt og kjøttbiprodukter': 'Red meat',
+    'Rødt kjøtt': 'Red meat',
+    'Hvit kjøtt': 'Poultry',
+    'kjøttbiprodukter': 'Red meat',
+    'Fisk (hel urenset rund vekt)': 'Fish',
+    'Fisk': 'Fish',
+    'Egg': 'Eggs',
+    'Helmelk': 'Dairy and alternatives',
+    'Lettmelk': 'Dairy and alternatives',
+    'Mager melk2': 'Dairy and alternatives',
+    'Yoghurt': 'Dairy and alternatives',
+    'Konserverte melkeprodukter': 'Dairy and alternatives',
+    'Fløte, rømme': 'Dairy and alternatives',
+    'Ost': 'Dairy and alternatives',
+    'Smør': 'Fats and oils',
+    'Margarin': 'Fats and oils',
+    'Sukker': 'Sweets and snacks'
+}
+
+# Norkost food group codes per category
+food_group_mapping = {
+    'Fruits and nuts': [
+        'FRUKTB'
+    ],
+    'Vegetables': [
+        'GRS_FF', 'GRS_BL', 'GRS_U', 'GRS_K',
+    ],
+    'Starchy vegetables': [
+        'POTET'
+    ],
+    'Grains and cereals': [
+        'BROD', 'KORNPR', 'KAKER'
+    ],
+    'Dairy and alternatives': [
+        'MELKYO', 'OST'
+    ],
+    'Red meat': [
+        'KJOT_R',
+        'KJOT_U', 'KJOT_M', 'KJOT_S', 'KJOT_P', 'KJO_AF',
+        'KJO_PL', 'KJO_AP', 'KJORET', 'BLODIN'
+    ],
+    'Poultry': [
+        'KJOT_HV'
+    ],
+    'Eggs': [
+        'EGG'
+    ],
+    'Fish': [
+        'FISK'
+    ],
+    'Legumes': [
+        'BELGFR'
+    ],
+    'Sweets and snacks': [
+        'SUKSOT'
+    ],
+    'Beverages': [
+        'DRIKKE'
+    ],
+    'Fats and oils': [
+        'SMARGO'
+    ],
+    'Miscellaneous': [
+        'DIVERS'
+    ]
+}
+
+# Study categories to the groups the supply balance is solved on. The SSB trade statistics only separate
+# meat, dairy and eggs, and vegetables and fruit, so the balance uses those groups for every source;
+# the trade groups map to themselves.
+balance_mapping = {
+    **{category: category for category in study_categories},
+    'Red meat': 'Meat',
+    'Poultry': 'Meat',
+    'Dairy and alternatives': 'Dairy and eggs',
+    'Eggs': 'Dairy and eggs',
+    'Vegetables': 'Vegetables and Fruits',
+    'Fruits and nuts': 'Vegetables and Fruits',
+    'Starchy vegetables': 'Vegetables and Fruits',
+    'Meat': 'Meat',
+    'Dairy and eggs': 'Dairy and eggs',
+    'Vegetables and Fruits': 'Vegetables and Fruits',
+}
+
+
+def invert_mapping(mapping):
+    # {category: [codes]} to {code: category}, a code listed under two categories is an error
+    inverted = {}
+    for category, codes in mapping.items():
+        for code in codes:
+            if code in inverted:
+                raise ValueError(f"'{code}' is mapped to both '{inverted[code]}' and '{category}'")
+            inverted[code] = category
+    return inverted
+
+
+#%% Registry
+registry = {
+    'foodwaste': foodwaste_mapping,
+    'trade': trade_mapping,
+    'matvaretabell': matvaretabell_mapping,
+    'national_consumption': national_consumption_mapping,
+    'individual_consumption': individual_consumption_mapping,
+    'norkost_food_groups': invert_mapping(food_group_mapping),
+    'balance': balance_mapping,
+}
+
+
+def validate_mapping(name, mapping):
+    if not mapping:
+        raise ValueError(f"Mapping '{name}' is empty")
+    for source, category in mapping.items():
+        if not isinstance(source, str) or not source.strip():
+            raise ValueError(f"Mapping '{name}' has an invalid source label {source!r}")
+        if category not in known_categories:
+            raise ValueError(f"Mapping '{name}' maps '{source}' to unknown category '{category}'")
+
+
+def register_mapping(name, mapping):
+    validate_mapping(name, mapping)
+    registry[name] = dict(mapping)
+    compile_mapping.cache_clear()
+    category_index.cache_clear()
+
+
+@lru_cache(maxsize=None)
+def compile_mapping(name):
+    # Sparse (sources x categories) 0/1 matrix of a registered mapping, compiled once per name.
+    # Categories are sorted like the columns of a groupby or pivot.
+    mapping = registry[name]
+    validate_mapping(name, mapping)
+    sources = pd.Index(list(mapping), name='Source')
+    categories = pd.Index(sorted(set(mapping.values())), name='Category')
+    matrix = sparse.csr_matrix(
+        (np.ones(len(sources)), (np.arange(len(sources)), categories.get_indexer(list(mapping.values())))),
+        shape=(len(sources), len(categories)),
+    )
+    return sources, categories, matrix
+
+
+def mapped_labels(labels, name):
+    # The labels that are sources of the mapping, and the unmapped ones
+    sources = compile_mapping(name)[0]
+    labels = pd.Index(labels)
+    return labels[labels.isin(sources)], labels[~labels.isin(sources)]
+
+
+def map_labels(labels, name):
+    # Category of each label, NaN where the label is not in the mapping
+    return pd.Series(labels).map(registry[name])
+
+
+#%% Aggregation
+@lru_cache(maxsize=None)
+def category_index(labels, name):
+    # Position of each label (a tuple) among the categories it reaches, -1 for unmapped labels.
+    # Cached, so a table with the same columns is reduced without looking the labels up again.
+    sources, categories, _ = compile_mapping(name)
+    source_positions = sources.get_indexer(list(labels))
+    category_positions = np.full(len(labels), -1)
+    mapped = source_positions >= 0
+    category_positions[mapped] = categories.get_indexer(map_labels(np.asarray(labels)[mapped], name))
+    present, positions = np.unique(category_positions[mapped], return_inverse=True)
+    category_positions[mapped] = positions
+    return category_positions, categories[present]
+
+
+def selection_matrix(labels, name):
+    # Rows of the compiled matrix for the given labels and the categories they reach
+    sources, categories, matrix = compile_mapping(name)
+    selection = matrix[sources.get_indexer(labels)]
+    present = np.asarray(selection.sum(axis=0)).ravel() > 0
+    return selection[:, present], categories[present]
+
+
+def aggregate_columns(df, name, min_count=0):
+    # Sum the columns of df into categories with one sparse product, columns that are not
+    # in the mapping are left out. Missing values count as 0 like in a groupby sum; like there,
+    # a category with fewer than min_count values in a row is NaN (min_count=1 keeps missing data missing).
+    columns, _ = mapped_labels(df.columns, name)
+    selection, categories = selection_matrix(columns, name)
+    values = df[columns].apply(pd.to_numeric, errors='coerce')
+    sums = (selection.T @ values.fillna(0).to_numpy(dtype=float).T).T
+    if min_count > 0:
+        counts = (selection.T @ values.notna().to_numpy(dtype=float).T).T
+        sums[counts < min_count] = np.nan
+    return pd.DataFrame(sums, index=df.index, columns=categories)
+
+
+def aggregate_rows(df, name, level=None):
+    # Sum the rows of df into categories with one sparse product. The source labels are the
+    # index, or the index level 'level'; the other levels are kept and moved to the front.
+    if level is None or df.index.nlevels == 1:
+        wide = df
+    else:
+        other_levels = [lev for lev in df.index.names if lev != level]
+        wide = df.unstack(other_levels)
+    rows, _ = mapped_labels(wide.index, name)
+    selection, categories = selection_matrix(rows, name)
+    values = wide.loc[rows].apply(pd.to_numeric, errors='coerce').fillna(0).to_numpy(dtype=float)
+    result = pd.DataFrame(selection.T @ values, index=categories.rename(level or categories.name), columns=wide.columns)
+    if wide is df:
+        return result
+    result = result.stack(other_levels)
+    return result.reorder_levels([level] + other_levels).sort_index()
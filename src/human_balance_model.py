@@ -0,0 +1,260 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+# Carbon content in macronutrients
+carbon_content = {
+    'Carbohydrates': 0.44,  # 44% Carbon
+    'Protein': 0.53,        # 53% Carbon
+    'Fat': 0.77             # 77% Carbon
+}
+
+# Excretion rates and base methane emission (grams/day) per age category
+age_category_parameters = pd.DataFrame({
+    'fecal_rate': [0.04, 0.05, 0.06],
+    'urinary_rate': [0.008, 0.01, 0.012],
+    'base_methane_emission': [0.5, 0.6, 0.7],
+}, index=pd.Index(['Adolescent', 'Adult', 'OlderAdult'], name='AgeCategory'))
+
+# Net carbon retention in the body (growth, or loss in old age) in grams of carbon per person and year,
+# per age category and gender. These are the per-group values of the original human_balance.xlsx.
+net_carbon_retention = pd.DataFrame({
+    'Female': [2478.0, 0.0, -708.0],
+    'Male': [3186.0, 0.0, -708.0],
+}, index=pd.Index(['Adolescent', 'Adult', 'OlderAdult'], name='AgeCategory'))
+
+# Phosphorus excretion rates
+phosphorus_rates = {
+    'urine': 0.67,
+    'feces': 0.33
+}
+
+# Relative standard deviation of the uncertain parameters in the Monte Carlo mode.
+# Draws are normal around the point estimates and clipped to [0, 1] (methane rates to >= 0).
+parameter_uncertainty = {
+    'carbon_content': 0.05,
+    'fecal_rate': 0.2,
+    'urinary_rate': 0.2,
+    'base_methane_emission': 0.3,
+    'phosphorus_urine': 0.1,
+}
+
+# Outputs summarised by percentile bands in the Monte Carlo mode
+uncertainty_outputs = ['Carbon_CO2', 'Carbon_CH4', 'Phosphorus_Urine', 'Phosphorus_Feces']
+
+REFERENCE_ENERGY_INTAKE = 2000  # Methane emission is scaled by energy intake relative to 2000 kcal
+CARBON_PER_CH4 = 12 / 16  # Convert CH4 to Carbon
+# (rows x draws) arrays alive at once in simulate_block, including the copy np.percentile sorts
+BLOCK_ARRAYS = 4
+
+
+def group_total(groups, values, minlength=0):
+    # Sum of values per group with missing values skipped like in a groupby sum, so one NaN row
+    # (e.g. a synthetic person without a respondent) does not make its whole group NaN
+    values = np.asarray(values, dtype=float)
+    return np.bincount(groups, weights=np.where(np.isnan(values), 0.0, values), minlength=minlength)
+
+
+def group_average(groups, values):
+    # Mean of values per group over the values that are not missing, like a groupby mean
+    values = np.asarray(values, dtype=float)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return group_total(groups, values) / np.bincount(groups, weights=~np.isnan(values))
+
+
+# Carbon and phosphorus balance of the food intake per Gender and AgeGroup.
+# The age category rules are lookup tables indexed by integer codes, so every step is a
+# whole-column NumPy operation.
+class HumanBalanceModel:
+    def __init__(self, carbon_content=carbon_content, age_parameters=age_category_parameters,
+                 phosphorus_rates=phosphorus_rates, carbon_retention=net_carbon_retention, group_cols=('Gender', 'AgeGroup')):
+        self.carbon_content = dict(carbon_content)
+        self.age_parameters = age_parameters
+        self.carbon_retention = carbon_retention
+        self.phosphorus_rates = dict(phosphorus_rates)
+        self.group_cols = list(group_cols)
+
+    def age_category_codes(self, age_groups):
+        # Position in age_parameters: 10-19 is Adolescent, 20-59 is Adult, everything else OlderAdult.
+        # The rule is evaluated once per distinct age group and broadcast back with the codes.
+        codes, labels = pd.factorize(pd.Series(age_groups))
+        age = pd.Series(labels).astype(str).str.extract(r'^(\d+)', expand=False).astype(float).to_numpy()
+        categories = np.select(
+            [(age >= 10) & (age <= 19), (age >= 20) & (age <= 59)],
+            ['Adolescent', 'Adult'],
+            'OlderAdult',
+        )
+        return self.age_parameters.index.get_indexer(categories)[codes]
+
+    def group_codes(self, df):
+        return df.groupby(self.group_cols, sort=False, observed=True).ngroup().to_numpy()
+
+    def retention(self, df, age_codes, zero_retention=False):
+        # Net carbon retention of every row's group in g/day: the 'NetCarbonRetention' column when df has one,
+        # else carbon_retention looked up by age category and gender. A group without a value raises.
+        # zero_retention=True takes every group to be in carbon balance instead, all absorbed carbon that is
+        # not excreted or emitted as CH4 then leaves as CO2.
+        if zero_retention:
+            return np.zeros(len(df))
+        if 'NetCarbonRetention' in df:
+            return df['NetCarbonRetention'].to_numpy(dtype=float)
+        genders = self.carbon_retention.columns.get_indexer(df['Gender'].astype(str))
+        yearly = self.carbon_retention.reindex(self.age_parameters.index).to_numpy(dtype=float)[age_codes, np.maximum(genders, 0)]
+        missing = (genders < 0) | np.isnan(yearly)
+        if missing.any():
+            groups = df.loc[missing, self.group_cols].drop_duplicates().astype(str).agg(' '.join, axis=1)
+            raise KeyError(f'No net carbon retention for {list(groups)}, add them to carbon_retention or pass zero_retention=True')
+        return yearly / 365
+
+    def run(self, consumption_df, zero_retention=False):
+        df = consumption_df.copy()
+        groups = self.group_codes(df)
+
+        # Carbon intake from macronutrients, a missing macronutrient counts as 0 like in a row sum
+        carbon_intake = np.zeros(len(df))
+        for nutrient, carbon_fraction in self.carbon_content.items():
+            df[f'{nutrient}_Carbon'] = df[nutrient].to_numpy(dtype=float) * carbon_fraction
+            carbon_intake += np.nan_to_num(df[f'{nutrient}_Carbon'].to_numpy())
+        df['Carbon_Intake'] = carbon_intake
+
+        # Convert Phosphorus intake from mg to grams
+        phosphorus_intake = df['Phosphorus'].to_numpy(dtype=float) / 1000
+        df['Phosphorus_Intake'] = phosphorus_intake
+
+        # Excretion rates and methane base emission looked up by age category
+        age_codes = self.age_category_codes(df['AgeGroup'])
+        df['AgeCategory'] = self.age_parameters.index.to_numpy()[age_codes]
+        parameters = self.age_parameters.to_numpy()[age_codes]
+        fecal_rate, urinary_rate, base_methane = parameters[:, 0], parameters[:, 1], parameters[:, 2]
+        df['Carbon_Feces'] = carbon_intake * fecal_rate
+        df['Carbon_Urine'] = carbon_intake * urinary_rate
+
+        # Methane emission per person, distributed to each food item by its caloric contribution
+        calories = df['Calories'].to_numpy(dtype=float)
+        total_calories = group_total(groups, calories)[groups]
+        average_energy_intake = group_average(groups, calories)[groups]
+        df['TotalCalories'] = total_calories
+        df['AverageEnergyIntake'] = average_energy_intake
+        df['Carbon_CH4_Total'] = base_methane * (average_energy_intake / REFERENCE_ENERGY_INTAKE) * CARBON_PER_CH4
+        df['Carbon_CH4'] = df['Carbon_CH4_Total'].to_numpy() * calories / total_calories
+
+        # Net carbon retention distributed to each food item by its carbon contribution
+        total_carbon_intake = group_total(groups, carbon_intake)[groups]
+        df['TotalCarbon_Intake'] = total_carbon_intake
+        df['NetCarbonRetention'] = self.retention(df, age_codes, zero_retention)
+        df['NetCarbonRetention_Item'] = df['NetCarbonRetention'].to_numpy() * carbon_intake / total_carbon_intake
+
+        # Carbon leaving as CO2 is what is not excreted, emitted as CH4 or retained
+        df['Carbon_CO2'] = carbon_intake - (
+            df['Carbon_Feces'].to_numpy() + df['Carbon_Urine'].to_numpy()
+            + df['Carbon_CH4'].to_numpy() + df['NetCarbonRetention_Item'].to_numpy()
+        )
+
+        # Phosphorus excretion
+        df['Phosphorus_Urine'] = phosphorus_intake * self.phosphorus_rates['urine']
+        df['Phosphorus_Feces'] = phosphorus_intake * self.phosphorus_rates['feces']
+        return df
+
+    #%% Monte Carlo uncertainty mode
+    def sample_parameters(self, n_draws, uncertainty=parameter_uncertainty, seed=None):
+        rng = np.random.default_rng(seed)
+
+        def draw(point, relative_sd, upper=1.0):
+            point = np.asarray(point, dtype=float)
+            values = point * (1 + relative_sd * rng.standard_normal((n_draws,) + point.shape))
+            return np.clip(values, 0.0, upper)
+
+        return {
+            'carbon_content': draw(list(self.carbon_content.values()), uncertainty['carbon_content']),
+            'fecal_rate': draw(self.age_parameters['fecal_rate'], uncertainty['fecal_rate']),
+            'urinary_rate': draw(self.age_parameters['urinary_rate'], uncertainty['urinary_rate']),
+            'base_methane_emission': draw(self.age_parameters['base_methane_emission'], uncertainty['base_methane_emission'], np.inf),
+            'phosphorus_urine': draw(self.phosphorus_rates['urine'], uncertainty['phosphorus_urine']),
+        }
+
+    def row_arrays(self, consumption_df, zero_retention=False):
+        # Everything in the balance that does not depend on the sampled parameters
+        df = consumption_df
+        groups = self.group_codes(df)
+        # Missing macronutrients count as 0 like in run, missing calories are skipped in the group totals
+        macros = np.nan_to_num(df[list(self.carbon_content)].to_numpy(dtype=float))
+        calories = df['Calories'].to_numpy(dtype=float)
+        total_calories = group_total(groups, calories)[groups]
+        average_energy_intake = group_average(groups, calories)[groups]
+        age_codes = self.age_category_codes(df['AgeGroup'])
+        return {
+            'macros': macros,
+            # Macronutrient totals per group, so the group carbon intake of every draw is one matmul
+            'group_macros': np.stack([group_total(groups, col, groups.max() + 1) for col in macros.T], axis=1),
+            'groups': groups,
+            'age_codes': age_codes,
+            'methane_scale': average_energy_intake / REFERENCE_ENERGY_INTAKE * CARBON_PER_CH4 * calories / total_calories,
+            'retention': self.retention(df, age_codes, zero_retention),
+            'phosphorus': df['Phosphorus'].to_numpy(dtype=float) / 1000,
+        }
+
+    def simulate(self, consumption_df, n_draws=10_000, percentiles=(5, 50, 95), uncertainty=parameter_uncertainty,
+                 seed=None, max_elements=20_000_000, processes=1, zero_retention=False):
+        # Evaluates the balance for every row and draw as (rows x draws) arrays and returns percentile bands.
+        # Rows are processed in blocks so that the BLOCK_ARRAYS arrays alive in a block hold at most
+        # max_elements values together, while all draws of a row stay together for exact percentiles.
+        # Blocks run in parallel with processes > 1, every task gets only the rows of its block.
+        params = self.sample_parameters(n_draws, uncertainty, seed)
+        arrays = self.row_arrays(consumption_df, zero_retention)
+        n_rows = len(consumption_df)
+        block_size = max(1, int(max_elements // (n_draws * BLOCK_ARRAYS)))
+        blocks = [slice(start, min(start + block_size, n_rows)) for start in range(0, n_rows, block_size)]
+
+        if processes == 1 or len(blocks) == 1:
+            results = [simulate_block(block_arrays(arrays, block), params, percentiles) for block in blocks]
+        else:
+            with ProcessPoolExecutor(max_workers=processes or os.cpu_count()) as pool:
+                results = list(pool.map(simulate_block, [block_arrays(arrays, block) for block in blocks],
+                                        [params] * len(blocks), [percentiles] * len(blocks)))
+
+        bands = {
+            f'{output}_p{q}': np.concatenate([result[output][i] for result in results])
+            for output in uncertainty_outputs
+            for i, q in enumerate(percentiles)
+        }
+        id_cols = [col for col in self.group_cols + ['FoodCategory'] if col in consumption_df]
+        return pd.concat([consumption_df[id_cols].reset_index(drop=True), pd.DataFrame(bands)], axis=1)
+
+
+def block_arrays(arrays, block):
+    # The row arrays of one block, the group totals are kept whole
+    return {name: values if name == 'group_macros' else values[block] for name, values in arrays.items()}
+
+
+def simulate_block(arrays, params, percentiles):
+    # Balance of the rows of one block for every parameter draw. Each array has shape (rows, draws),
+    # so the percentiles are taken along contiguous memory. The carbon terms are accumulated in place
+    # and every output is reduced to its percentiles before the next one is computed, so no more than
+    # BLOCK_ARRAYS (rows, draws) arrays are alive at once.
+    age_codes = arrays['age_codes']
+    carbon_content = params['carbon_content'].T
+    carbon_intake = arrays['macros'] @ carbon_content
+
+    # CO2 is the carbon intake minus feces, urine, the retained share and CH4
+    carbon_co2 = params['fecal_rate'].T[age_codes]
+    carbon_co2 += params['urinary_rate'].T[age_codes]
+    np.subtract(1.0, carbon_co2, out=carbon_co2)
+    carbon_co2 *= carbon_intake
+    retained = (arrays['group_macros'] @ carbon_content)[arrays['groups']]
+    np.divide(carbon_intake, retained, out=retained)
+    retained *= arrays['retention'][:, None]
+    carbon_co2 -= retained
+    del carbon_intake, retained
+    carbon_ch4 = params['base_methane_emission'].T[age_codes]
+    carbon_ch4 *= arrays['methane_scale'][:, None]
+    carbon_co2 -= carbon_ch4
+
+    bands = {'Carbon_CO2': np.percentile(carbon_co2, percentiles, axis=1)}
+    del carbon_co2
+    bands['Carbon_CH4'] = np.percentile(carbon_ch4, percentiles, axis=1)
+    del carbon_ch4
+    bands['Phosphorus_Urine'] = np.percentile(np.outer(arrays['phosphorus'], params['phosphorus_urine']), percentiles, axis=1)
+    bands['Phosphorus_Feces'] = np.percentile(np.outer(arrays['phosphorus'], 1 - params['phosphorus_urine']), percentiles, axis=1)
+    return bands
@@ -0,0 +1,180 @@
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from norkost_loader import parquet_available
+from schema import AGE_GROUPS, GENDERS, age_group_dtype, gender_dtype
+
+# The synthetic population is written as one Parquet file per chunk in data/cache/microsim
+MICROSIM_DIR = os.path.join(os.path.dirname(__file__), '..', 'data', 'cache', 'microsim')
+# Bytes of the person arrays of one chunk, the chunk size follows from it and the number of categories
+MAX_CHUNK_BYTES = 64 * 1024 ** 2
+
+# Every person is in one Gender x AgeGroup cell, cell = gender code * len(AGE_GROUPS) + age code
+N_CELLS = len(GENDERS) * len(AGE_GROUPS)
+
+
+#%% Inputs of the simulation
+def cell_codes(gender, age_group):
+    gender = pd.Series(gender).astype(gender_dtype).cat.codes.to_numpy()
+    age_group = pd.Series(age_group).astype(age_group_dtype).cat.codes.to_numpy()
+    if (gender < 0).any() or (age_group < 0).any():
+        raise ValueError('Every person needs a Gender and AgeGroup of the shared schema')
+    return gender.astype(np.int64) * len(AGE_GROUPS) + age_group
+
+
+def cell_persons(df_pop, year=None, total=None):
+    # Persons per cell from the SSB table (the latest year by default). With total, the cells keep the
+    # SSB structure and are scaled to that population, rounded so they add up to total exactly.
+    year_cols = [col for col in df_pop.columns if col not in ('Gender', 'AgeGroup')]
+    year = str(year or year_cols[-1])
+    persons = np.bincount(cell_codes(df_pop['Gender'], df_pop['AgeGroup']), weights=df_pop[year].to_numpy(dtype=float),
+                          minlength=N_CELLS)
+    if total is None:
+        return np.rint(persons).astype(np.int64)
+    scaled = persons / persons.sum() * total
+    counts = np.floor(scaled).astype(np.int64)
+    # Largest remainders get the persons lost to the rounding
+    counts[np.argsort(counts - scaled)[:int(total) - counts.sum()]] += 1
+    return counts
+
+
+class RespondentPool:
+    # Norkost respondents sorted by cell. A synthetic person copies the whole intake row of one respondent
+    # of its cell, so the spread and the correlation between categories of the survey are kept.
+    # Cells without respondents (children, Norkost 3 starts at 18) get NaN intake and respondent -1.
+    def __init__(self, df_food, categories):
+        cells = cell_codes(df_food['Gender'], df_food['AgeGroup'])
+        order = np.argsort(cells, kind='stable')
+        self.categories = list(categories)
+        self.ids = df_food['ID'].to_numpy()[order].astype(np.int32)
+        self.intake = df_food[self.categories].to_numpy(dtype=np.float32)[order]
+        self.counts = np.bincount(cells, minlength=N_CELLS)
+        self.starts = np.concatenate([[0], np.cumsum(self.counts)[:-1]])
+
+    def sample(self, cells, rng):
+        # Row of a random respondent of every person's cell, -1 for cells without respondents.
+        # Computed in place, next to the cells at most four more int64/float64 arrays of the persons.
+        counts = self.counts[cells]
+        rows = rng.random(len(cells))
+        rows *= counts
+        rows = rows.astype(np.int64)
+        rows += self.starts[cells]
+        rows[counts == 0] = -1
+        return rows
+
+
+#%% Chunks
+def person_bytes(n_categories):
+    # Peak bytes per person of simulate_chunk, reached while the Parquet file is written: the float32
+    # intake in numpy and in Arrow (with a validity bit per value) and its dictionary-encoded pages (about a
+    # byte per value, the rows repeat those of the respondents), the respondent ID and the two codes in
+    # numpy and in Arrow, and the int64 cell and sampled row and the sampled mask of every person.
+    # Sampling itself holds five int64/float64 arrays of the chunk, before the intake exists.
+    return (2 * 4 + 1) * n_categories + -(-n_categories // 8) + 2 * (4 + 2) + 2 * 8 + 1
+
+
+def chunk_bounds(n_persons, n_categories, max_chunk_bytes=MAX_CHUNK_BYTES):
+    # Person ranges of the chunks, sized so one chunk stays within max_chunk_bytes
+    chunk_size = max(1, max_chunk_bytes // person_bytes(n_categories))
+    return [(start, min(start + chunk_size, n_persons)) for start in range(0, n_persons, chunk_size)]
+
+
+# The respondent pool and cell sizes of the running simulation, set once in every process by use_pool
+# instead of being sent with every chunk
+shared_pool = {}
+
+
+def use_pool(pool, persons):
+    shared_pool.update(pool=pool, persons=persons)
+
+
+def simulate_chunk(start, stop, seed, path):
+    # Persons start..stop of the population ordered by cell. The chunk is written to path and its
+    # cell x category intake sums and person counts are returned for aggregation without reading it back.
+    pool, persons = shared_pool['pool'], shared_pool['persons']
+    cell_starts = np.concatenate([[0], np.cumsum(persons)])
+    in_chunk = np.clip(np.minimum(cell_starts[1:], stop) - np.maximum(cell_starts[:-1], start), 0, None)
+    cells = np.repeat(np.arange(N_CELLS), in_chunk)
+    rows = pool.sample(cells, np.random.default_rng(seed))
+    sampled = rows >= 0
+    intake = pool.intake[np.maximum(rows, 0)]
+    intake[~sampled] = np.nan
+
+    table = pd.DataFrame(intake, columns=pool.categories)
+    table.insert(0, 'Respondent', np.where(sampled, pool.ids[np.maximum(rows, 0)], -1).astype(np.int32))
+    table.insert(0, 'AgeGroup', pd.Categorical.from_codes(cells % len(AGE_GROUPS), dtype=age_group_dtype))
+    table.insert(0, 'Gender', pd.Categorical.from_codes(cells // len(AGE_GROUPS), dtype=gender_dtype))
+    table.to_parquet(path, index=False)
+
+    # The persons of a cell are one run of rows, summed in float64 one run at a time
+    sums = np.zeros((N_CELLS, len(pool.categories)))
+    run_stops = np.cumsum(in_chunk)
+    for cell in np.flatnonzero((in_chunk > 0) & (pool.counts > 0)):
+        sums[cell] = intake[run_stops[cell] - in_chunk[cell]:run_stops[cell]].sum(axis=0, dtype=float)
+    return sums, in_chunk
+
+
+def simulate_population(df_food, categories, df_pop, year=None, total=None, out_dir=MICROSIM_DIR, seed=0,
+                        max_chunk_bytes=MAX_CHUNK_BYTES, processes=1):
+    # Synthetic population of one person per row: Gender and AgeGroup from SSB and the intake (g/day) of a
+    # sampled Norkost respondent of the same cell. The persons are generated in chunks of at most
+    # max_chunk_bytes, in parallel with processes > 1. Every chunk has its own seed from one SeedSequence,
+    # so the population only depends on seed, not on the number of processes.
+    # Returns the cell x category intake sums of the whole population.
+    if not parquet_available():
+        raise ImportError('Writing the synthetic population needs pyarrow')
+    pool = RespondentPool(df_food, categories)
+    persons = cell_persons(df_pop, year, total)
+    bounds = chunk_bounds(int(persons.sum()), len(pool.categories), max_chunk_bytes)
+    seeds = np.random.SeedSequence(seed).spawn(len(bounds))
+
+    os.makedirs(out_dir, exist_ok=True)
+    for name in os.listdir(out_dir):
+        if name.startswith('part-') and name.endswith('.parquet'):
+            os.remove(os.path.join(out_dir, name))
+    paths = [os.path.join(out_dir, f'part-{i:05d}.parquet') for i in range(len(bounds))]
+    starts, stops = [start for start, _ in bounds], [stop for _, stop in bounds]
+
+    if processes == 1 or len(bounds) == 1:
+        use_pool(pool, persons)
+        results = [simulate_chunk(*args) for args in zip(starts, stops, seeds, paths)]
+    else:
+        # The pool goes to every worker once through the initializer, the chunks only carry their range
+        with ProcessPoolExecutor(max_workers=processes or os.cpu_count(), initializer=use_pool,
+                                 initargs=(pool, persons)) as executor:
+            results = list(executor.map(simulate_chunk, starts, stops, seeds, paths))
+
+    with open(os.path.join(out_dir, 'population.json'), 'w', encoding='utf-8') as f:
+        json.dump({'persons': int(persons.sum()), 'chunks': len(bounds), 'seed': seed,
+                   'categories': pool.categories}, f)
+    sums = sum(result[0] for result in results)
+    counts = sum(result[1] for result in results)
+    return cell_table(sums, counts, pool.categories)
+
+
+#%% Aggregation
+def cell_table(sums, counts, categories):
+    # Gender x AgeGroup table of the persons and their summed intake in g/day
+    index = pd.MultiIndex.from_product([pd.CategoricalIndex(GENDERS, dtype=gender_dtype),
+                                        pd.CategoricalIndex(AGE_GROUPS, dtype=age_group_dtype)],
+                                       names=['Gender', 'AgeGroup'])
+    table = pd.DataFrame(sums, index=index, columns=categories)
+    table.insert(0, 'Persons', counts)
+    return table
+
+
+def aggregate_population(out_dir=MICROSIM_DIR, by=('Gender', 'AgeGroup'), columns=None):
+    # Summed intake (g/day) of the written population grouped by 'by', read one chunk at a time
+    with open(os.path.join(out_dir, 'population.json'), encoding='utf-8') as f:
+        meta = json.load(f)
+    columns = meta['categories'] if columns is None else list(columns)
+    total = None
+    for i in range(meta['chunks']):
+        chunk = pd.read_parquet(os.path.join(out_dir, f'part-{i:05d}.parquet'), columns=list(by) + columns)
+        grouped = chunk.groupby(list(by), observed=False)[columns].sum()
+        total = grouped if total is None else total.add(grouped, fill_value=0)
+    return total
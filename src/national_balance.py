@@ -0,0 +1,57 @@
+#%% Importing the libraries
+import os
+import pandas as pd
+import matplotlib.pyplot as plt
+from demand_projection import load_ssb_population
+from supply_balance import align_terms, balance_table, load_national_supply, solve_balance
+from trade_store import load_trade_store
+from waste_flow import household_consumption, load_stage_waste
+
+#%% Terms of the national balance, all in tonnes per year
+# Domestic food supply from Helsedirektoratet
+df_supply = load_national_supply()
+
+# Imports and exports from the SSB trade store
+trade_store = load_trade_store()
+df_imports = trade_store.series('Imports').T
+df_exports = trade_store.series('Exports').T
+
+# Waste of all supply-chain stages together
+df_waste = load_stage_waste().sum('stage').to_series().unstack('category')
+
+# Intake: the NK3 per-capita intake weighted with the SSB age and gender structure and scaled to the
+# population of every year, for the categories the survey covers
+folder_path = os.path.join(os.path.dirname(__file__), '..', 'data', 'auxiliary')
+df_nk3 = pd.read_excel(os.path.join(folder_path, 'average percapita consumption_nk3.xlsx'))
+years = sorted(set(df_supply.index) | set(df_imports.index) | set(df_waste.index))
+df_intake = household_consumption(load_ssb_population(), df_nk3, years, df_nk3['FoodCategory'].unique())
+
+#%% Solve the balance for every category and year
+# supply = intake + waste + unexplained supply, and production = supply - imports + exports
+aligned = align_terms({
+    'Supply': df_supply,
+    'Intake': df_intake,
+    'Waste': df_waste,
+    'Imports': df_imports,
+    'Exports': df_exports,
+})
+residuals = solve_balance(aligned)
+df_balance = balance_table(aligned, residuals)
+print(df_balance.dropna(subset=['Unexplained supply']).round(0))
+
+# Export the balance to the auxiliary folder
+balance_path = os.path.join(folder_path, 'supply_balance.xlsx')
+df_balance.to_excel(balance_path, index=False)
+print(f"Supply balance exported to {balance_path}")
+
+#%% Plot the unexplained supply for the years with supply, intake and waste
+df_unexplained = residuals.sel(residual='Unexplained supply').to_series().unstack('category').dropna(how='all')
+ax = df_unexplained.plot(kind='bar', figsize=(12, 6))
+ax.axhline(0, color='black', linewidth=0.5)
+ax.set_xlabel('Year')
+ax.set_ylabel('Tonnes per year')
+ax.set_title('Supply not Accounted for by Intake and Waste')
+ax.legend(title='Food Category', bbox_to_anchor=(1.05, 1), loc='upper left')
+plt.tight_layout()
+plt.show()
+# %%
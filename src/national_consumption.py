@@ -4,9 +4,11 @@ import pandas as pd
 import numpy as np
 import seaborn as sns
 import matplotlib.pyplot as plt
+from harmonization import aggregate_columns
+from schema import normalize_frame
 #%%
 # Load the excel file from Helsedirektoratet folder in raw
-file_path = os.path.join(os.path.dirname(__file__), '..', 'data', 'raw', 'Helsedirektoratet')
+file_path = os.path.join(os.path.dirname(__file__), '..', 'data', 'raw', 'helsedirektoratet')
 filename = 'national consumption.xlsx'
 df = pd.read_excel(os.path.join(file_path, filename))
 # drop the last three rows
@@ -15,42 +17,8 @@ df.drop(df.tail(3).index, inplace=True)
 df = df.tail(5)
 
 #%%
-# Print all the column names to map with the study categories
-
-category_mapping_new = {
-    'Korn, som mel': 'Grains and cereals',  # Grain products
-    'Ris, gryn og mel': 'Grains and cereals',  # Rice, grains, and flour
-    'Poteter, friske': 'Starchy vegetables',  # Fresh potatoes
-    'Potetprodukter': 'Starchy vegetables',  # Potato products (processed)
-    'Potetmel': 'Starchy vegetables',  # Potato starch
-    'Sukker/sukkervarer': 'Sweets and snacks',  # Sugar and confectionery
-    'Erter/nøtter/kakao': 'Legumes',  # Peas, nuts, and cocoa (mainly focusing on peas and nuts)
-    'Kakaoprodukter': 'Sweets and snacks',  # Cocoa products (e.g., chocolate)
-    'Grønnsaker': 'Vegetables',  # Vegetables
-    'Frukt og bær': 'Fruits and nuts',  # Fruits and berries
-    'Kjøtt': 'Red meat',  # Meat (generic, includes red meat)
-    'Kjøttbiprodukter': 'Red meat',  # Meat by-products (assumed to be from red meat)
-    'Egg': 'Eggs',  # Eggs
-    'Fisk': 'Fish',  # Fish
-    'Helmelk': 'Dairy and alternatives',  # Whole milk
-    'Lettmelk': 'Dairy and alternatives',  # Low-fat milk
-    'Skummet melk': 'Dairy and alternatives',  # Skimmed milk
-    'Yoghurt': 'Dairy and alternatives',  # Yogurt
-    'Melkeprodukter': 'Dairy and alternatives',  # Dairy products
-    'Fløte, rømme (38%)': 'Dairy and alternatives',  # Cream and sour cream (38% fat)
-    'Ost': 'Dairy and alternatives',  # Cheese
-    'Smør': 'Fats and oils',  # Butter
-    'Margarin': 'Fats and oils',  # Margarine
-    'Herav lettmargarin': 'Fats and oils',  # Light margarine
-    'Annet fett': 'Fats and oils',  # Other fats (unspecified)
-    'Uspesifisert handel': 'Miscellaneous',  # Unspecified trade
-    'Grensehandel': 'Miscellaneous'  # Border trade (unspecified)
-}
-
-# Applying the mapping to the dataframe columns
-df_mapped = df.rename(columns=category_mapping_new)
-# Summing columns within the same category
-grouped_df = df_mapped.groupby(axis=1, level=0).sum()
+# Sum the columns into the study categories with the compiled national consumption mapping
+grouped_df = aggregate_columns(df, 'national_consumption')
 grouped_df['Year'] = df['Year']  # Add back the 'Year' column
 grouped_df.set_index('Year', inplace=True)
 # Calculate the average consumption for each category over the years
@@ -66,42 +34,17 @@ print(average_consumption)
 individual_file_path = os.path.join(os.path.dirname(__file__), '..', 'data', 'raw', 'helsedirektoratet', 'individual consumption.xlsx')
 individual_df = pd.read_excel(individual_file_path)
 
-# Drop the first 5 rows
-individual_df.drop(individual_df.head(5).index, inplace=True)
+# Keep the rows of a year, the header is already read by read_excel and the sheet has no notes
+individual_df = individual_df[pd.to_numeric(individual_df['Year'], errors='coerce').notna()]
 
 # Reset the index
 individual_df.reset_index(drop=True, inplace=True)
 
-# Define the category mapping for individual data
-individual_category_mapping = {
-    'Korn, som mel (inkl. ris)': 'Grains and cereals',
-    'Matpoteter': 'Starchy vegetables',
-    'Poteter til bearbeiding': 'Starchy vegetables',
-    'Grønnsaker': 'Vegetables',
-    'Frukt og bær': 'Fruits and nuts',
-    'Kjøtt og kjøttbiprodukter': 'Red meat',
-    'Fisk (hel urenset rund vekt)': 'Fish',
-    'Egg': 'Eggs',
-    'Helmelk': 'Dairy and alternatives',
-    'Lettmelk': 'Dairy and alternatives',
-    'Mager melk2': 'Dairy and alternatives',
-    'Yoghurt': 'Dairy and alternatives',
-    'Konserverte melkeprodukter': 'Dairy and alternatives',
-    'Fløte, rømme': 'Dairy and alternatives',
-    'Ost': 'Dairy and alternatives',
-    'Smør': 'Fats and oils',
-    'Margarin': 'Fats and oils',
-    'Sukker': 'Sweets and snacks'
-}
-
-# Rename the columns using the individual category mapping
-individual_df_renamed = individual_df.rename(columns=individual_category_mapping)
-
 # Group columns by category and sum their values for each year
-individual_grouped_df = individual_df_renamed.groupby(axis=1, level=0).sum()
+individual_grouped_df = aggregate_columns(individual_df, 'individual_consumption')
 
 # Assuming 'Year' is a column in individual_df_renamed, set it as the index
-individual_grouped_df['Year'] = individual_df_renamed['Year']
+individual_grouped_df['Year'] = individual_df['Year']
 individual_grouped_df.set_index('Year', inplace=True)
 
 # Add the row for average consumption
@@ -115,12 +58,12 @@ print(individual_grouped_df.head())
 #%%
 # Comparison with upscaled values from human balance
 # Load the Excel file
-file_path = os.path.join(os.path.dirname(__file__), '..', 'data', 'auxillary', 'average consumption.xlsx')
-norkost_df = pd.read_excel(file_path)
+file_path = os.path.join(os.path.dirname(__file__), '..', 'data', 'auxiliary', 'average consumption.xlsx')
+norkost_df = normalize_frame(pd.read_excel(file_path))
 norkost_df.head()
 
 #Create a df that contains average consumption of all age groups 
-norkost_df_avg = norkost_df.groupby('FoodCategory').mean().reset_index()
+norkost_df_avg = norkost_df.groupby('FoodCategory', observed=True)[['Average amount consumed (g)']].mean().reset_index()
 norkost_df_avg.set_index('FoodCategory', inplace=True)
 norkost_df_avg = norkost_df_avg[[ 'Average amount consumed (g)']]
 norkost_df_avg.rename(columns={'Average amount consumed (g)': 'Average'}, inplace=True)
@@ -0,0 +1,169 @@
+import hashlib
+import os
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from excel_reader import read_sheets
+from harmonization import category_index
+from schema import normalize
+
+# Location of the Norkost 3 workbook and the sheets used by the analysis scripts
+NORKOST3_PATH = os.path.join(os.path.dirname(__file__), '..', 'data', 'raw', 'norkost', 'Norkost 3-data til NTNU.xlsx')
+BACKGROUND_SHEET = 'Bakgrunnsvariabler'
+FOODGROUPS_SHEET = 'Matvaregrupper'
+ENERGY_SHEET = 'Stoffer u tilskudd'
+
+# Cleaned sheets are cached as Parquet files in data/cache/norkost
+CACHE_DIR = os.path.join(os.path.dirname(__file__), '..', 'data', 'cache', 'norkost')
+# Bump this when the cleaning functions change so old cache entries are ignored
+CACHE_VERSION = 3
+
+#%% Cleaning functions for each sheet
+def clean_background(df_background):
+    df_background = df_background.rename(columns={
+        'Nr': 'ID',
+        "Alder": "Age",
+        "Utdann1": "Education",
+        "Kjønn": "Gender",
+        "Landsdel": "Region"
+    })
+    df_background['ID'] = pd.to_numeric(df_background['ID'], errors='coerce')
+    df_background = df_background.dropna(subset=['ID']).reset_index(drop=True)
+    df_background['ID'] = df_background['ID'].astype(int)
+    df_background['Age'] = pd.to_numeric(df_background['Age'], errors='coerce')
+    # Gender and education codes become the labels of the shared schema
+    df_background['Gender'] = normalize(pd.to_numeric(df_background['Gender'], errors='coerce'), 'Gender')
+    df_background['Education'] = normalize(pd.to_numeric(df_background['Education'], errors='coerce'), 'Education')
+    df_background['Region'] = normalize(df_background['Region'], 'Region')
+    return df_background
+
+
+def clean_food_groups(df_food_groups):
+    df_food_groups = df_food_groups.rename(columns={'Nr': 'ID'})
+
+    # Drop the label and unit rows below the header, which have no ID
+    df_food_groups['ID'] = pd.to_numeric(df_food_groups['ID'], errors='coerce')
+    df_food_groups = df_food_groups.dropna(subset=['ID']).reset_index(drop=True)
+    df_food_groups['ID'] = df_food_groups['ID'].astype(int)
+
+    # The amounts are read as objects, convert them to numbers
+    code_columns = df_food_groups.columns.drop('ID')
+    df_food_groups[code_columns] = df_food_groups[code_columns].apply(pd.to_numeric, errors='coerce')
+    df_food_groups = df_food_groups.dropna(axis=1, how='all')  # Drop any fully empty columns
+    df_food_groups['TOTALT'] = df_food_groups['TOTALT'].fillna(0)
+    return df_food_groups
+
+
+def clean_energy(df_energy):
+    df_energy = df_energy.rename(columns={'Nr': 'ID', 'Energi': 'Energy'})
+    # Drop the unit row below the header, which has no ID
+    df_energy['ID'] = pd.to_numeric(df_energy['ID'], errors='coerce')
+    df_energy = df_energy.dropna(subset=['ID']).reset_index(drop=True)
+    df_energy['ID'] = df_energy['ID'].astype(int)
+    df_energy['Energy'] = pd.to_numeric(df_energy['Energy'], errors='coerce') / 4.184  # Convert KJ to Kcal
+    return df_energy
+
+
+# Sheet name, projected columns (None keeps every column) and cleaning function for each cached table
+norkost3_tables = {
+    'background': (BACKGROUND_SHEET, ['Nr', 'Kjønn', 'Alder', 'Utdann1', 'Landsdel'], clean_background),
+    'food_groups': (FOODGROUPS_SHEET, None, clean_food_groups),
+    'energy': (ENERGY_SHEET, ['Nr', 'Energi'], clean_energy),
+}
+
+
+#%% Parquet cache keyed by the workbook content hash and the sheet name
+def file_digest(file_path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def parquet_available():
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def cache_path(file_path, sheet_name, digest, cache_dir=CACHE_DIR):
+    workbook = os.path.splitext(os.path.basename(file_path))[0]
+    return os.path.join(cache_dir, f'{workbook}__{sheet_name}__v{CACHE_VERSION}__{digest[:16]}.parquet')
+
+
+def remove_stale_entries(file_path, sheet_name, keep, cache_dir=CACHE_DIR):
+    # Only entries of the same workbook and sheet are removed, other workbooks keep their cache
+    workbook = os.path.splitext(os.path.basename(file_path))[0]
+    prefix = f'{workbook}__{sheet_name}__'
+    for name in os.listdir(cache_dir):
+        path = os.path.join(cache_dir, name)
+        if name.startswith(prefix) and name.endswith('.parquet') and path != keep:
+            os.remove(path)
+
+
+def load_norkost3(file_path=NORKOST3_PATH, cache_dir=CACHE_DIR, use_cache=True):
+    # Returns the cleaned df_background, df_food_groups and df_energy tables
+    use_cache = use_cache and parquet_available()
+    digest = file_digest(file_path) if use_cache else None
+
+    tables = {}
+    missing = {}
+    for key, (sheet_name, columns, clean) in norkost3_tables.items():
+        if use_cache:
+            path = cache_path(file_path, sheet_name, digest, cache_dir)
+            if os.path.exists(path):
+                tables[key] = pd.read_parquet(path)
+                continue
+        missing[key] = (sheet_name, columns, clean)
+
+    if missing:
+        # Open the workbook once and only read the projected columns of the sheets that are not cached yet
+        raw_tables = read_sheets(file_path, {sheet_name: columns for sheet_name, columns, _ in missing.values()})
+        for key, (sheet_name, columns, clean) in missing.items():
+            tables[key] = clean(raw_tables[sheet_name])
+            if use_cache:
+                os.makedirs(cache_dir, exist_ok=True)
+                path = cache_path(file_path, sheet_name, digest, cache_dir)
+                tables[key].to_parquet(path, index=False)
+                remove_stale_entries(file_path, sheet_name, path, cache_dir)
+
+    return tables['background'], tables['food_groups'], tables['energy']
+
+
+#%% Food group reduction
+def reduce_food_groups(df_food_groups, mapping_name='norkost_food_groups'):
+    # Respondent x category sums of the Matvaregrupper code columns and the TOTALT check in one pass.
+    # TOTALT and the code columns are read as one NumPy block and multiplied by a sparse
+    # (columns x outputs) reducer: a mapped code adds to its category and is subtracted from
+    # the last output, which starts from TOTALT and so ends as the TOTALT difference.
+    columns = ['TOTALT'] + [col for col in df_food_groups.columns if col not in ('ID', 'TOTALT')]
+    positions, categories = category_index(tuple(columns[1:]), mapping_name)
+    mapped = np.flatnonzero(positions >= 0)
+    difference = len(categories)
+    reducer = sparse.csr_matrix(
+        (
+            np.concatenate([np.ones(len(mapped)), -np.ones(len(mapped)), [1.0]]),
+            (
+                np.concatenate([mapped + 1, mapped + 1, [0]]),
+                np.concatenate([positions[mapped], np.full(len(mapped), difference), [difference]]),
+            ),
+        ),
+        shape=(len(columns), difference + 1),
+    )
+    block = np.nan_to_num(df_food_groups[columns].to_numpy(dtype=float), copy=False)
+    reduced = (reducer.T @ block.T).T
+
+    df_food = pd.DataFrame(reduced[:, :difference], columns=categories)
+    df_food.insert(0, 'ID', df_food_groups['ID'].to_numpy())
+    df_check = pd.DataFrame({
+        'ID': df_food_groups['ID'].to_numpy(),
+        'TotalConsumption': block[:, 0] - reduced[:, difference],
+        'TOTALT': block[:, 0],
+        'Difference': reduced[:, difference],
+    })
+    return df_food, df_check
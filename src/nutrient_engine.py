@@ -0,0 +1,52 @@
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+# Nutrient totals and the food_composition.xlsx column (content per 100 g) each is computed from.
+# A new nutrient is one more entry here, the totals are still a single product.
+nutrient_columns = {
+    'TotalDryMatter': 'Percent Dry Matter',
+    'TotalFat': 'Fat (g)',
+    'TotalProtein': 'Protein (g)',
+    'TotalCarbohydrates': 'Carbohydrate (g)',
+    'TotalCalories': 'Kilokalorier (kcal)',
+    'TotalPhosphorus': 'Phosphorus (P) (mg)'
+}
+
+
+def composition_matrix(df_food_composition, categories, nutrients=nutrient_columns, category_col='FoodCategory'):
+    # (categories x nutrients) content per gram, NaN for categories without composition data
+    table = df_food_composition.set_index(category_col)[list(nutrients.values())]
+    return table.reindex(categories).to_numpy(dtype=float) / 100
+
+
+def missing_categories(df_food_composition, categories, category_col='FoodCategory'):
+    categories = pd.Index(categories)
+    return categories[~categories.isin(df_food_composition[category_col])]
+
+
+def entity_nutrients(df_intake, df_food_composition, nutrients=nutrient_columns, category_col='FoodCategory'):
+    # Nutrient totals of every entity (respondent or group) from a wide (entities x categories)
+    # table of amounts in grams
+    composition = composition_matrix(df_food_composition, df_intake.columns, nutrients, category_col)
+    totals = df_intake.to_numpy(dtype=float) @ composition
+    return pd.DataFrame(totals, index=df_intake.index, columns=list(nutrients))
+
+
+def nutrient_totals(df, df_food_composition, amount_col='Average amount consumed (g)', category_col='FoodCategory',
+                    nutrients=nutrient_columns):
+    # Nutrient totals of every row of a long table with one food category and amount per row.
+    # The rows form a sparse (rows x categories) intake matrix, so all totals come from one product
+    # with the composition matrix. Rows of categories without composition data and rows without a
+    # category are NaN, as with a left merge on the composition table.
+    categories = pd.Index(df[category_col].dropna().unique())
+    codes = categories.get_indexer(df[category_col])
+    # get_indexer gives -1 for a row it cannot place, which the sparse matrix would take as the last column
+    matched = codes >= 0
+    intake = sparse.csr_matrix(
+        (df[amount_col].to_numpy(dtype=float)[matched], (np.flatnonzero(matched), codes[matched])),
+        shape=(len(df), len(categories)),
+    )
+    totals = intake @ composition_matrix(df_food_composition, categories, nutrients, category_col)
+    totals[~matched] = np.nan
+    return pd.DataFrame(totals, index=df.index, columns=list(nutrients))
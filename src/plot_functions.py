@@ -1,7 +1,12 @@
+import os
+
 import matplotlib.pyplot as plt
 import seaborn as sns
 import pandas as pd
 import numpy as np
+from matplotlib.animation import FFMpegWriter, FuncAnimation, PillowWriter, writers
+from matplotlib.collections import PolyCollection
+from matplotlib.ticker import FuncFormatter
 
 def plot_energy_distribution(df_energy_m, mean_energy_male, std_energy_male, mean_energy_female, std_energy_female):
     plt.figure(figsize=(10, 6))
@@ -55,61 +60,142 @@ def plot_average_consumption_by_age_group(average_consumption_age_group, colors)
     plt.tight_layout()
     plt.show()
 
-def plot_population_pyramid(metric, ylabel, color_dict, df, NorkostVersion):
-    desired_order = [
-        'Fruits and nuts', 'Vegetables', 'Starchy vegetables', 'Grains and cereals', 'Legumes',
-        'Dairy and alternatives', 'Eggs', 'Poultry', 'Red meat', 'Fish', 'Fats and oils',
-        'Sweets and snacks', 'Miscellaneous'
+# Stacking order of the food categories in the pyramids
+pyramid_categories = [
+    'Fruits and nuts', 'Vegetables', 'Starchy vegetables', 'Grains and cereals', 'Legumes',
+    'Dairy and alternatives', 'Eggs', 'Poultry', 'Red meat', 'Fish', 'Fats and oils',
+    'Sweets and snacks', 'Miscellaneous'
+]
+
+
+def pyramid_matrices(df, metric, categories, sides, age_col='AgeGroup', gender_col='Gender', category_col='FoodCategory'):
+    # Age groups and one (age groups x categories) matrix per side of the pyramid, 0 where there is no data
+    groups = sorted(df[age_col].unique())
+    pivot = df.pivot_table(index=age_col, columns=[gender_col, category_col], values=metric,
+                           aggfunc='sum', fill_value=0, observed=True)
+    matrices = []
+    for side in sides:
+        side_values = pivot[side] if side in pivot.columns.get_level_values(0) else pd.DataFrame(index=pivot.index)
+        matrices.append(side_values.reindex(index=groups, columns=categories, fill_value=0).to_numpy(dtype=float))
+    return groups, matrices
+
+
+def bar_vertices(y, left, width, height):
+    # (bars, 4, 2) corners of horizontal bars
+    x0, x1 = left, left + width
+    y0, y1 = y - height / 2, y + height / 2
+    return np.stack([np.stack([x0, y0], -1), np.stack([x0, y1], -1), np.stack([x1, y1], -1), np.stack([x1, y0], -1)], axis=1)
+
+
+def pyramid_vertices(left_values, right_values, height=0.8):
+    # Bar corners of every category, (2 * groups, 4, 2) with the left side first. The offsets of all
+    # bars come from one cumsum over the categories.
+    y = np.arange(left_values.shape[0], dtype=float)
+    left_offsets = np.cumsum(left_values, axis=1) - left_values
+    right_offsets = np.cumsum(right_values, axis=1) - right_values
+    return [
+        np.concatenate([bar_vertices(y, -left_offsets[:, j], -left_values[:, j], height),
+                        bar_vertices(y, right_offsets[:, j], right_values[:, j], height)])
+        for j in range(left_values.shape[1])
     ]
 
-    pivot_data = df.pivot_table(
-        index=['AgeGroup', 'Gender'],
-        columns='FoodCategory',
-        values=metric,
-        aggfunc='sum',
-        fill_value=0
-    )
 
-    for category in desired_order:
-        if category not in pivot_data.columns:
-            pivot_data[category] = 0
+def draw_pyramid(ax, left_values, right_values, colors, right_colors=None, height=0.8):
+    # Stacked bars of two (groups x categories) matrices, the left side drawn to negative x. Every
+    # category is one PolyCollection with the bars of both sides, so the number of artists does not
+    # grow with the number of age groups.
+    right_colors = colors if right_colors is None else right_colors
+    n_groups = left_values.shape[0]
+    collections = []
+    for j, vertices in enumerate(pyramid_vertices(left_values, right_values, height)):
+        facecolors = [colors[j]] * n_groups + [right_colors[j]] * n_groups
+        collection = PolyCollection(vertices, facecolors=facecolors, edgecolors='none')
+        ax.add_collection(collection)
+        collections.append(collection)
+    ax.set_yticks(np.arange(n_groups))
+    ax.autoscale_view()
+    return collections
 
-    pivot_data = pivot_data[desired_order]
-    pivot_data = pivot_data.sort_index(level='AgeGroup')
 
-    fig, ax = plt.subplots(figsize=(14, 10))
-    age_groups = sorted(df['AgeGroup'].unique())
-    categories = desired_order
-
-    for age_group in age_groups:
-        for gender in ['Male', 'Female']:
-            if (age_group, gender) in pivot_data.index:
-                data = pivot_data.loc[(age_group, gender)]
-            else:
-                data = pd.Series(0, index=categories)
-
-            cumulative = 0
-            for category in categories:
-                value = data[category]
-                color = color_dict.get(category, '#333333')
-
-                if gender == 'Male':
-                    ax.barh(age_group, value, left=cumulative, color=color, edgecolor='none')
-                    cumulative += value
-                else:
-                    ax.barh(age_group, -value, left=-cumulative, color=color, edgecolor='none')
-                    cumulative += value
+def plot_population_pyramid(df, metric, ylabel, color_dict, title=None, categories=pyramid_categories,
+                            left='Female', right='Male', age_col='AgeGroup', gender_col='Gender', category_col='FoodCategory'):
+    # Stacked pyramid of a metric by age group, gender and food category of a long table
+    groups, (left_values, right_values) = pyramid_matrices(df, metric, categories, [left, right], age_col, gender_col, category_col)
+    colors = [color_dict.get(category, '#333333') for category in categories]
 
+    fig, ax = plt.subplots(figsize=(14, 10))
+    draw_pyramid(ax, left_values, right_values, colors)
+    ax.set_yticklabels(groups)
     ax.set_xlabel(ylabel)
     ax.set_ylabel('Age Group')
-    ax.set_title(f'{ylabel} per capita by Age Group and Gender ({NorkostVersion})')
-    handles = [plt.Rectangle((0, 0), 1, 1, color=color_dict.get(category, '#333333')) for category in categories]
-    labels = categories
-    ax.legend(handles, labels, title='Food Categories', bbox_to_anchor=(1.05, 1), loc='upper left')
-    max_value = pivot_data.sum(axis=1).max()
+    ax.set_title(title or f'{ylabel} by Age Group and Gender')
+    handles = [plt.Rectangle((0, 0), 1, 1, color=color) for color in colors]
+    ax.legend(handles, categories, title='Food Categories', bbox_to_anchor=(1.05, 1), loc='upper left')
+    max_value = max(left_values.sum(axis=1).max(), right_values.sum(axis=1).max())
     ax.set_xlim(-max_value * 1.05, max_value * 1.05)
-    ax.text(max_value * 0.8, len(age_groups), 'Male', ha='center', va='center', fontsize=12, color='blue')
-    ax.text(-max_value * 0.8, len(age_groups), 'Female', ha='center', va='center', fontsize=12, color='red')
+    ax.text(max_value * 0.8, len(groups), right, ha='center', va='center', fontsize=12, color='blue')
+    ax.text(-max_value * 0.8, len(groups), left, ha='center', va='center', fontsize=12, color='red')
     ax.axvline(0, color='black', linewidth=0.5)
     plt.tight_layout()
     plt.show()
+    return fig, ax
+
+
+def animate_pyramid(left_frames, right_frames, groups, frame_labels, path=None, colors=('#333333',), right_colors=None,
+                    left='Female', right='Male', xlabel='Population', title='Population Pyramid', fps=4, blit=True, dpi=100):
+    # Pyramid animation over (frames x groups) or (frames x groups x categories) arrays. The collections
+    # are built once and only their vertices change per frame. path ending in .mp4 or .gif writes the
+    # animation, any other path is a folder for one PNG per frame; without a path the animation is returned.
+    left_frames = np.asarray(left_frames, dtype=float)
+    right_frames = np.asarray(right_frames, dtype=float)
+    if left_frames.ndim == 2:
+        left_frames, right_frames = left_frames[..., None], right_frames[..., None]
+
+    fig, ax = plt.subplots(figsize=(10, 8))
+    collections = draw_pyramid(ax, left_frames[0], right_frames[0], list(colors), None if right_colors is None else list(right_colors))
+    ax.set_yticklabels(groups)
+    max_value = max(left_frames.sum(axis=2).max(), right_frames.sum(axis=2).max())
+    ax.set_xlim(-max_value * 1.05, max_value * 1.05)
+    ax.xaxis.set_major_formatter(FuncFormatter(lambda x, pos: f'{abs(x):,.0f}'))
+    ax.set_xlabel(xlabel)
+    ax.set_ylabel('Age Group')
+    ax.set_title(title)
+    right_color = colors[0] if right_colors is None else right_colors[0]
+    # Free row above the oldest group for the side and frame labels
+    ax.set_ylim(-0.6, len(groups) + 0.2)
+    ax.text(max_value * 0.8, len(groups) - 0.2, right, ha='center', va='center', fontsize=12, color=right_color)
+    ax.text(-max_value * 0.8, len(groups) - 0.2, left, ha='center', va='center', fontsize=12, color=colors[0])
+    ax.axvline(0, color='black', linewidth=0.5)
+    # The frame label is inside the axes so blitting redraws it
+    label = ax.text(0, len(groups) - 0.2, '', ha='center', va='center', fontsize=14)
+    plt.tight_layout()
+
+    def update(frame):
+        for collection, vertices in zip(collections, pyramid_vertices(left_frames[frame], right_frames[frame])):
+            collection.set_verts(vertices)
+        label.set_text(str(frame_labels[frame]))
+        return collections + [label]
+
+    for artist in collections + [label]:
+        artist.set_animated(blit)
+    animation = FuncAnimation(fig, update, frames=len(frame_labels), interval=1000 / fps, blit=blit)
+    if path is None:
+        return animation
+
+    extension = os.path.splitext(path)[1].lower()
+    if extension == '.mp4':
+        if not writers.is_available('ffmpeg'):
+            raise RuntimeError('Writing MP4 needs ffmpeg, write a .gif or a frame folder instead')
+        animation.save(path, writer=FFMpegWriter(fps=fps), dpi=dpi)
+    elif extension == '.gif':
+        animation.save(path, writer=PillowWriter(fps=fps), dpi=dpi)
+    else:
+        # Animated artists are left out of a normal draw, the frames are saved as plain figures
+        for artist in collections + [label]:
+            artist.set_animated(False)
+        os.makedirs(path, exist_ok=True)
+        for frame in range(len(frame_labels)):
+            update(frame)
+            fig.savefig(os.path.join(path, f'frame_{frame:04d}.png'), dpi=dpi)
+    plt.close(fig)
+    return animation
@@ -0,0 +1,51 @@
+#%% Importing the libraries
+import os
+import time
+import numpy as np
+import pandas as pd
+from norkost_loader import load_norkost3, reduce_food_groups
+from schema import age_group_from_age
+from demand_projection import GRAMS_PER_DAY_TO_TONNES_PER_YEAR, load_ssb_population, population_demand
+from microsimulation import aggregate_population, simulate_population
+
+
+# The script runs in main(), so the process pool workers of the simulation can import it without running it
+def main():
+#%% Norkost 3 respondents with their intake per food category
+    df_background, df_food_groups, df_energy = load_norkost3()
+    df_food, _ = reduce_food_groups(df_food_groups)
+    df_food = pd.merge(df_background[['ID', 'Age', 'Gender']], df_food, on='ID', how='left')
+    category_columns = df_food.columns.difference(['ID', 'Age', 'Gender'])
+    df_food[category_columns] = df_food[category_columns].fillna(0)
+    df_food['AgeGroup'] = age_group_from_age(df_food['Age'])
+
+#%% Synthetic population
+    # One row per person with the SSB age and gender structure scaled to about 5.5 million people, every
+    # person eats like a random Norkost 3 respondent of the same gender and age group.
+    # SIMULATION_PROCESSES sets the size of the process pool.
+    df_pop = load_ssb_population()
+    start = time.perf_counter()
+    population = simulate_population(df_food, category_columns, df_pop, total=5_500_000,
+                                     processes=int(os.environ.get('SIMULATION_PROCESSES', 1)))
+    print(f"Simulated {population['Persons'].sum():,} persons in {time.perf_counter() - start:.1f} s")
+
+    # Tonnes per year of every category for the simulated population
+    print((population[category_columns].sum() * GRAMS_PER_DAY_TO_TONNES_PER_YEAR).round(0))
+
+#%% Check against the group averages
+    # Upscaling the NK3 per-capita averages of population_demand.py to the same population gives the
+    # expected totals; the simulation differs by the sampling noise only
+    df_nk3 = pd.read_excel(os.path.join('..', 'data', 'auxiliary', 'average percapita consumption_nk3.xlsx'))
+    df_scaled = df_pop[['Gender', 'AgeGroup']].copy()
+    df_scaled['Simulated'] = population['Persons'].reindex(pd.MultiIndex.from_frame(df_pop[['Gender', 'AgeGroup']])).to_numpy()
+    expected = population_demand(df_scaled, df_nk3, ['Average amount consumed (g)'])
+    expected = expected.groupby('FoodCategory', observed=True)['Average amount consumed (g)'].sum()
+    simulated = aggregate_population(by=['Gender']).sum()
+    comparison = pd.DataFrame({'Group averages': expected, 'Microsimulation': simulated.reindex(expected.index)})
+    comparison['Relative difference'] = comparison['Microsimulation'] / comparison['Group averages'] - 1
+    print(comparison.replace([np.inf, -np.inf], np.nan).round(4))
+# %%
+
+
+if __name__ == '__main__':
+    main()
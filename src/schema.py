@@ -0,0 +1,116 @@
+import numpy as np
+import pandas as pd
+
+# Canonical labels of the dimensions shared by the pipelines. Every loader normalizes its
+# labels with the tables below and stores the columns as these Categorical dtypes.
+GENDERS = ['Female', 'Male']
+AGE_GROUPS = ['0-9', '10-19', '20-29', '30-39', '40-49', '50-59', '60-69', '70+']
+FOOD_CATEGORIES = [
+    'Fruits and nuts',
+    'Vegetables',
+    'Starchy vegetables',
+    'Grains and cereals',
+    'Legumes',
+    'Dairy and alternatives',
+    'Red meat',
+    'Poultry',
+    'Eggs',
+    'Fish',
+    'Fats and oils',
+    'Sweets and snacks',
+    'Beverages',
+    'Miscellaneous'
+]
+# Landsdel of the Norkost 3 respondents
+REGIONS = [
+    'Oslo og Akershus',
+    'Hedmark og Oppland',
+    'Sør-Østlandet',
+    'Agder og Rogaland',
+    'Vestlandet',
+    'Trøndelag',
+    'Nord-Norge'
+]
+# Norkost 3 'Utdann1' codes, from no education to postgraduate
+education_codes = {
+    0: "None",
+    1: "Primary school",
+    2: "Middle school",
+    3: "High school",
+    4: "Higher secondary",
+    5: "Vocational training",
+    6: "Undergraduate",
+    7: "Postgraduate",
+    9: "Unanswered"
+}
+EDUCATION_LEVELS = list(education_codes.values())
+
+gender_dtype = pd.CategoricalDtype(GENDERS)
+age_group_dtype = pd.CategoricalDtype(AGE_GROUPS, ordered=True)
+food_category_dtype = pd.CategoricalDtype(FOOD_CATEGORIES)
+region_dtype = pd.CategoricalDtype(REGIONS)
+education_dtype = pd.CategoricalDtype(EDUCATION_LEVELS, ordered=True)
+
+#%% Normalization tables from the spellings in the source files to the canonical labels
+gender_labels = {
+    'Female': 'Female', 'Females': 'Female', 'female': 'Female', 2: 'Female',  # Norkost codes 1 and 2
+    'Male': 'Male', 'Males': 'Male', 'male': 'Male', 1: 'Male',
+}
+
+# Norkost writes '20-29', SSB '20-29 years'. Everyone aged 70 or older is one group, because SSB
+# only publishes 70+ and the oldest Norkost respondents are just over 70. So '70-79' (the oldest group
+# of the Norkost tables and of 'Average consumption by age and gender.xlsx') is folded into '70+':
+# its per-capita intake stands for all persons aged 70 and older when it is scaled with the population,
+# and the normalized tables and their exports say '70+' where the source says '70-79'.
+age_group_labels = {}
+for start in range(0, 70, 10):
+    age_group_labels[f'{start}-{start + 9}'] = f'{start}-{start + 9}'
+    age_group_labels[f'{start}-{start + 9} years'] = f'{start}-{start + 9}'
+for label in ['70+', '70-79', '80-89', '90-99', '70-79 years', '80-89 years', '90-99 years',
+              '70 years or older', '100 years or older']:
+    age_group_labels[label] = '70+'
+age_group_labels['16-19'] = '10-19'  # Youngest Norkost 2 group
+
+dimensions = {
+    'Gender': (gender_dtype, gender_labels),
+    'AgeGroup': (age_group_dtype, age_group_labels),
+    'FoodCategory': (food_category_dtype, {label: label for label in FOOD_CATEGORIES}),
+    'Region': (region_dtype, {label: label for label in REGIONS}),
+    'Education': (education_dtype, {**education_codes, **{label: label for label in EDUCATION_LEVELS}}),
+}
+
+
+#%% Normalization
+def normalize(values, dimension):
+    # Canonical Categorical of a column, labels that are not in the table raise a ValueError
+    dtype, labels = dimensions[dimension]
+    values = pd.Series(values)
+    if isinstance(values.dtype, pd.CategoricalDtype) and values.dtype == dtype:
+        return values
+    # Map the distinct labels once and broadcast back through the codes
+    codes, uniques = pd.factorize(values)
+    mapped = pd.Series(uniques).map(lambda label: labels.get(label.strip() if isinstance(label, str) else label))
+    unknown = uniques[mapped.isna().to_numpy()]
+    if len(unknown):
+        raise ValueError(f'Unknown {dimension} labels: {list(unknown)}')
+    category_codes = dtype.categories.get_indexer(mapped)
+    return pd.Series(
+        pd.Categorical.from_codes(np.where(codes >= 0, category_codes[codes], -1), dtype=dtype),
+        index=values.index,
+        name=values.name,
+    )
+
+
+def normalize_frame(df):
+    # Normalize every schema column present in df
+    df = df.copy()
+    for dimension in dimensions:
+        if dimension in df:
+            df[dimension] = normalize(df[dimension], dimension)
+    return df
+
+
+def age_group_from_age(ages):
+    # Age in years to the canonical age groups
+    bins = list(range(0, 71, 10)) + [np.inf]
+    return pd.cut(pd.Series(ages), bins=bins, right=False, labels=AGE_GROUPS).astype(age_group_dtype)
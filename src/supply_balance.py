@@ -0,0 +1,64 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from demand_projection import DemandCube
+from harmonization import aggregate_columns
+
+NATIONAL_CONSUMPTION_PATH = os.path.join(os.path.dirname(__file__), '..', 'data', 'raw', 'helsedirektoratet', 'national consumption.xlsx')
+
+# Terms of the balance, every term is a year x category table in tonnes per year
+BALANCE_TERMS = ['Supply', 'Intake', 'Waste', 'Imports', 'Exports']
+
+# Residuals solved for every category and year, as signed sums of the terms. The domestic supply that
+# intake and waste do not account for, and the production implied by the supply and the trade.
+balance_equations = {
+    'Unexplained supply': {'Supply': 1, 'Intake': -1, 'Waste': -1},
+    'Implied production': {'Supply': 1, 'Imports': -1, 'Exports': 1},
+}
+
+
+#%% Loaders
+def load_national_supply(file_path=NATIONAL_CONSUMPTION_PATH):
+    # Helsedirektoratet food supply per study category in tonnes per year (the file is in 1000 tonnes).
+    # Only single years are kept; ranges like '1953-1955' and the notes are left out. A category is NaN in
+    # the years where all its columns are '..' (not available).
+    df = pd.read_excel(file_path)
+    years = pd.to_numeric(df['Year'], errors='coerce')
+    df = df[years.notna()].set_index(years[years.notna()].astype(int).rename('Year')).drop(columns='Year')
+    return aggregate_columns(df, 'national_consumption', min_count=1) * 1000
+
+
+#%% Reconciliation
+def align_terms(terms, mapping_name='balance'):
+    # (term, year, category) array of every term, given as year x study (or trade) category tables, summed
+    # into the balance categories. Years and categories are the union over the terms; a term without
+    # data for a year or category is NaN there, also when the table has the year but no values for it.
+    grouped = {name: aggregate_columns(table, mapping_name, min_count=1) for name, table in terms.items()}
+    years = sorted(set().union(*(table.index for table in grouped.values())))
+    categories = sorted(set().union(*(table.columns for table in grouped.values())))
+    values = np.stack([table.reindex(index=years, columns=categories).to_numpy(dtype=float) for table in grouped.values()])
+    return DemandCube(values, {'term': list(grouped), 'year': years, 'category': categories}, name='Tonnes/year')
+
+
+def solve_balance(aligned, equations=balance_equations):
+    # (residual, year, category) residuals of all equations in one product of the signed coefficient
+    # matrix with the stacked terms. A residual is NaN where one of its terms is missing.
+    terms = list(aligned.coords['term'])
+    unknown = {term for equation in equations.values() for term in equation} - set(terms)
+    if unknown:
+        raise KeyError(f'Balance terms without data: {sorted(unknown)}')
+    coefficients = np.array([[equation.get(term, 0) for term in terms] for equation in equations.values()], dtype=float)
+    values = aligned.values.reshape(len(terms), -1)
+    missing = np.isnan(values)
+    residuals = coefficients @ np.where(missing, 0.0, values)
+    residuals[(coefficients != 0) @ missing > 0] = np.nan
+    coords = {'residual': list(equations), 'year': aligned.coords['year'], 'category': aligned.coords['category']}
+    return DemandCube(residuals.reshape((len(equations),) + aligned.values.shape[1:]), coords, name='Tonnes/year')
+
+
+def balance_table(aligned, residuals):
+    # Long table with the terms and residuals as columns for every year and category
+    table = pd.concat([aligned.to_series().unstack('term'), residuals.to_series().unstack('residual')], axis=1)
+    return table[list(aligned.coords['term']) + list(residuals.coords['residual'])].reset_index()
@@ -0,0 +1,76 @@
+import numpy as np
+import pandas as pd
+
+from schema import dimensions
+
+
+#%% Margins
+def population_margin(df_pop, year, by=('Gender', 'AgeGroup'), labels=None):
+    # Persons of the SSB table in year by the schema columns of 'by'. labels keeps only these labels of
+    # the last dimension, e.g. the age groups a survey covers completely.
+    by = [by] if isinstance(by, str) else list(by)
+    margin = df_pop.groupby(by, observed=True)[str(year)].sum()
+    if labels is not None:
+        margin = margin[margin.index.get_level_values(by[-1]).isin(labels)]
+    return margin
+
+
+def margin_codes(df, margin):
+    # Position of every respondent's cell in the margin, -1 for cells the margin has no target for
+    names = list(margin.index.names)
+    shape = tuple(len(dimensions[name][0].categories) for name in names)
+    respondent_codes = [df[name].astype(dimensions[name][0]).cat.codes.to_numpy() for name in names]
+    if any((codes < 0).any() for codes in respondent_codes):
+        raise ValueError(f'Respondents without a label of {names}, every respondent needs one')
+    target_codes = [margin.index.get_level_values(i).astype(dimensions[name][0]).codes for i, name in enumerate(names)]
+    cells = np.full(int(np.prod(shape)), -1)
+    cells[np.ravel_multi_index(target_codes, shape)] = np.arange(len(margin))
+    return cells[np.ravel_multi_index(respondent_codes, shape)]
+
+
+#%% Raking
+def rake(df, margins, weights=None, max_iter=50, tol=1e-6):
+    # Iterative proportional fitting of respondent weights to population margins. margins maps a schema
+    # column (or a tuple of columns) to the target totals of its labels, e.g. {('Gender', 'AgeGroup'): ...}.
+    # Every pass scales the weights once per margin with one bincount, until the weighted shares of all
+    # margins are within tol of the targets. Labels without a target are not calibrated: their
+    # respondents keep their weight and the calibrated labels keep their combined weight.
+    # Returns weights with mean 1, indexed like df.
+    weights = np.ones(len(df)) if weights is None else np.asarray(weights, dtype=float).copy()
+    prepared = []
+    for key, margin in margins.items():
+        names = [key] if isinstance(key, str) else list(key)
+        margin = margin.rename_axis(names)
+        cells = margin_codes(df, margin)
+        targets = margin.to_numpy(dtype=float)
+        covered = cells >= 0
+        present = np.bincount(cells[covered], minlength=len(margin)) > 0
+        if not present.any():
+            raise ValueError(f'No respondent has a label of the {names} margin')
+        # Targets of labels without respondents cannot be reached and are left out
+        prepared.append((cells, covered, np.where(present, targets / targets[present].sum(), 0.0)))
+
+    for iteration in range(max_iter):
+        error = 0.0
+        for cells, covered, shares in prepared:
+            totals = np.bincount(cells[covered], weights=weights[covered], minlength=len(shares))
+            current = totals / totals.sum()
+            error = max(error, np.abs(current - shares).max())
+            with np.errstate(invalid='ignore', divide='ignore'):
+                factors = np.where(totals > 0, shares / current, 1.0)
+            weights[covered] *= factors[cells[covered]]
+        if error < tol:
+            break
+    else:
+        raise RuntimeError(f'Raking did not converge in {max_iter} passes, largest share error {error:.2e}')
+    return pd.Series(weights / weights.mean(), index=df.index, name='Weight')
+
+
+def weighted_mean(df, by, columns, weights='Weight'):
+    # Weighted means of columns for every group of 'by' with one grouped sum of the weighted values
+    columns = [columns] if isinstance(columns, str) else list(columns)
+    w = df[weights].to_numpy(dtype=float)
+    weighted = pd.DataFrame(df[columns].to_numpy(dtype=float) * w[:, None], columns=columns, index=df.index)
+    weighted['_weight'] = np.where(df[columns].notna().all(axis=1), w, 0.0)
+    grouped = weighted.join(df[by]).groupby(by, observed=True).sum()
+    return grouped[columns].div(grouped['_weight'], axis=0)
@@ -0,0 +1,163 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from harmonization import aggregate_rows
+from norkost_loader import file_digest, parquet_available
+
+TRADE_PATH = os.path.join(os.path.dirname(__file__), '..', 'data', 'raw', 'ssb', 'Imports and exports of food.xlsx')
+
+# The store is a long Parquet table per level in data/cache/trade, next to a small metadata file
+STORE_DIR = os.path.join(os.path.dirname(__file__), '..', 'data', 'cache', 'trade')
+# Bump this when parse_trade or the store layout changes so the store is rebuilt
+STORE_VERSION = 1
+
+FLOWS = ['Imports', 'Exports']
+
+
+#%% Parse the SSB table
+def parse_trade(file_path=TRADE_PATH):
+    # Long table with Flow, SITC division, Year and tonnes for every year column in the file, so new
+    # SSB years are picked up without changing the code
+    df = pd.read_excel(file_path, header=3)
+    df['Flow'] = df['Unnamed: 0'].ffill()
+    df = df.drop(columns='Unnamed: 0').rename(columns={'Unnamed: 1': 'SITC'})
+    year_columns = [col for col in df.columns if str(col).strip().isdigit()]
+    # Rows without a division or with missing years are the notes below the table
+    df = df.dropna(subset=['SITC'] + year_columns)
+    df = df.melt(id_vars=['Flow', 'SITC'], value_vars=year_columns, var_name='Year', value_name='Tonnes')
+    df['Year'] = df['Year'].astype(str).str.strip().astype(int)
+    df['Tonnes'] = pd.to_numeric(df['Tonnes'], errors='coerce').astype(float)
+    return df.reset_index(drop=True)
+
+
+def aggregate_trade(divisions):
+    # Food Category x Flow x Year long table of the SITC divisions summed with the compiled trade mapping
+    wide = divisions.pivot_table(index=['SITC', 'Flow'], columns='Year', values='Tonnes', aggfunc='sum')
+    categories = aggregate_rows(wide, 'trade', level='SITC')
+    table = categories.stack().rename('Tonnes').reset_index()
+    return table.rename(columns={'SITC': 'Food Category'})[['Food Category', 'Flow', 'Year', 'Tonnes']]
+
+
+#%% Store
+class TradeStore:
+    # Dense (category, flow, year) array of the trade in tonnes with running sums along the years. A year
+    # range is a slice of the year axis, so series, totals and averages of any range are read without
+    # regrouping, and new or revised years only update the sums from the first changed year on.
+    def __init__(self, table, divisions, digest=None):
+        self.divisions = divisions
+        self.digest = digest
+        self.categories = pd.Index(sorted(table['Food Category'].unique()), name='Food Category')
+        self.flows = pd.Index([flow for flow in FLOWS if flow in set(table['Flow'])], name='Flow')
+        self.years = np.array([], dtype=int)
+        self.values = np.zeros((len(self.categories), len(self.flows), 0))
+        self.cumulative = np.zeros((len(self.categories), len(self.flows), 1))
+        self.set_years(table)
+
+    def position(self, year):
+        # Index of a year on the year axis, KeyError for years that are not in the store
+        if year not in self.year_index:
+            raise KeyError(f'{year} is not in the trade store ({self.years.min()}-{self.years.max()})')
+        return self.year_index[year]
+
+    def year_slice(self, start=None, end=None):
+        # Inclusive range of years, None for the first or last year of the store
+        first = 0 if start is None else self.position(int(start))
+        last = len(self.years) - 1 if end is None else self.position(int(end))
+        return slice(first, last + 1)
+
+    def set_years(self, table):
+        # Add or replace the years of a long Food Category x Flow x Year table
+        wide = table.pivot_table(index=['Food Category', 'Flow'], columns='Year', values='Tonnes', aggfunc='sum')
+        years = np.union1d(self.years, wide.columns.astype(int))
+        values = np.zeros((len(self.categories), len(self.flows), len(years)))
+        values[:, :, np.searchsorted(years, self.years)] = self.values
+        index = pd.MultiIndex.from_product([self.categories, self.flows])
+        new_values = wide.reindex(index).fillna(0).to_numpy(dtype=float)
+        positions = np.searchsorted(years, wide.columns.astype(int))
+        values[:, :, positions] = new_values.reshape(len(self.categories), len(self.flows), len(positions))
+
+        # Running sums are only recomputed from the first year that changed
+        first = int(positions.min())
+        cumulative = np.zeros(values.shape[:2] + (len(years) + 1,))
+        cumulative[:, :, :first + 1] = self.cumulative[:, :, :first + 1]
+        cumulative[:, :, first + 1:] = cumulative[:, :, [first]] + np.cumsum(values[:, :, first:], axis=2)
+
+        self.years, self.values, self.cumulative = years, values, cumulative
+        self.year_index = {int(year): i for i, year in enumerate(years)}
+
+    def series(self, flow, start=None, end=None):
+        # Category x year tonnes of one flow for a year range
+        years = self.year_slice(start, end)
+        return pd.DataFrame(self.values[:, self.flows.get_loc(flow), years], index=self.categories,
+                            columns=pd.Index(self.years[years], name='Year'))
+
+    def total(self, flow, start=None, end=None):
+        years = self.year_slice(start, end)
+        cumulative = self.cumulative[:, self.flows.get_loc(flow)]
+        return pd.Series(cumulative[:, years.stop] - cumulative[:, years.start], index=self.categories, name='Total')
+
+    def average(self, flow, start=None, end=None):
+        years = self.year_slice(start, end)
+        return (self.total(flow, start, end) / (years.stop - years.start)).rename('Average')
+
+    def to_frame(self):
+        index = pd.MultiIndex.from_product([self.categories, self.flows, pd.Index(self.years, name='Year')])
+        return pd.Series(self.values.ravel(), index=index, name='Tonnes').reset_index()
+
+
+#%% Persist and update
+def save_store(store, store_dir=STORE_DIR):
+    os.makedirs(store_dir, exist_ok=True)
+    store.to_frame().to_parquet(os.path.join(store_dir, 'categories.parquet'), index=False)
+    store.divisions.to_parquet(os.path.join(store_dir, 'divisions.parquet'), index=False)
+    with open(os.path.join(store_dir, 'store.json'), 'w', encoding='utf-8') as f:
+        json.dump({'version': STORE_VERSION, 'digest': store.digest, 'years': [int(year) for year in store.years]}, f)
+
+
+def read_store(store_dir=STORE_DIR):
+    # None when there is no store of the current version
+    meta_path = os.path.join(store_dir, 'store.json')
+    if not os.path.exists(meta_path):
+        return None
+    with open(meta_path, encoding='utf-8') as f:
+        meta = json.load(f)
+    if meta['version'] != STORE_VERSION:
+        return None
+    table = pd.read_parquet(os.path.join(store_dir, 'categories.parquet'))
+    divisions = pd.read_parquet(os.path.join(store_dir, 'divisions.parquet'))
+    return TradeStore(table, divisions, meta['digest'])
+
+
+def changed_years(stored, divisions):
+    # Years of the parsed table that are new or whose division values differ from the store
+    merged = divisions.merge(stored, on=['Flow', 'SITC', 'Year'], how='outer', suffixes=('', ' stored'), indicator=True)
+    differs = (merged['_merge'] != 'both') | ~np.isclose(merged['Tonnes'], merged['Tonnes stored'], equal_nan=True)
+    return set(merged.loc[differs, 'Year'].astype(int))
+
+
+def load_trade_store(file_path=TRADE_PATH, store_dir=STORE_DIR, rebuild=False):
+    # The workbook is only aggregated for the years that are new or revised since the store was saved.
+    # Without pyarrow the store is built in memory every time.
+    persist = parquet_available()
+    digest = file_digest(file_path)
+    store = None if rebuild or not persist else read_store(store_dir)
+    if store is not None and store.digest == digest:
+        return store
+
+    divisions = parse_trade(file_path)
+    if store is None:
+        store = TradeStore(aggregate_trade(divisions), divisions, digest)
+    else:
+        years = changed_years(store.divisions, divisions)
+        if set(store.years) - set(divisions['Year']) or set(store.divisions['SITC']) != set(divisions['SITC']):
+            # Dropped years or other divisions change the shape of the store, it is rebuilt
+            store = TradeStore(aggregate_trade(divisions), divisions, digest)
+        elif years:
+            store.set_years(aggregate_trade(divisions[divisions['Year'].isin(years)]))
+        store.divisions, store.digest = divisions, digest
+    if persist:
+        save_store(store, store_dir)
+    return store
@@ -0,0 +1,74 @@
+import numpy as np
+import pandas as pd
+
+
+# Polynomial features x^1 .. x^degree of the (centred) years, the intercept is fitted separately
+def polynomial_features(x, degree):
+    return np.stack([x ** power for power in range(1, degree + 1)], axis=-1)
+
+
+# Fit a polynomial trend of y on x for every group with one batched least-squares solve.
+# The groups are stacked into a design tensor of shape (groups, max observations, degree),
+# padded with zero rows, and solved together with the pseudo-inverse. As in LinearRegression,
+# the features and the target are centred per group, so groups with fewer observations than
+# coefficients get the minimum-norm solution.
+def fit_polynomial_trends(df, group_cols, x_col, y_col, degree=2, min_obs=2, origin=0.0):
+    data = df[group_cols + [x_col, y_col]].dropna()
+    grouped = data.groupby(group_cols, sort=True, observed=True)
+    codes = grouped.ngroup().to_numpy()
+    groups = grouped.size().index
+    counts = np.bincount(codes, minlength=len(groups))
+
+    # Position of each observation inside its group, used to scatter the rows into the tensor
+    order = np.argsort(codes, kind='stable')
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    positions = np.empty(len(codes), dtype=int)
+    positions[order] = np.arange(len(codes)) - np.repeat(starts, counts)
+
+    # The years can be shifted by a common origin to keep x^2 well conditioned. With the default
+    # origin of 0 the fits match PolynomialFeatures + LinearRegression on the raw years.
+    x = data[x_col].to_numpy(dtype=float)
+    features = polynomial_features(x - origin, degree)
+    y = data[y_col].to_numpy(dtype=float)
+
+    n_groups, n_obs = len(groups), counts.max() if len(counts) else 0
+    design = np.zeros((n_groups, n_obs, degree))
+    target = np.zeros((n_groups, n_obs))
+    mask = np.zeros((n_groups, n_obs), dtype=bool)
+    design[codes, positions] = features
+    target[codes, positions] = y
+    mask[codes, positions] = True
+
+    # Centre each group on its own means, the padded rows stay zero and do not affect the solution
+    safe_counts = np.maximum(counts, 1)
+    feature_means = design.sum(axis=1) / safe_counts[:, None]
+    target_means = target.sum(axis=1) / safe_counts
+    design = (design - feature_means[:, None, :]) * mask[:, :, None]
+    target = (target - target_means[:, None]) * mask
+
+    coefs = np.einsum('gpn,gn->gp', np.linalg.pinv(design), target)
+    intercepts = target_means - np.einsum('gp,gp->g', feature_means, coefs)
+
+    coef_table = groups.to_frame(index=False)
+    coef_table['Intercept'] = intercepts
+    for power in range(1, degree + 1):
+        coef_table[f'x^{power}'] = coefs[:, power - 1]
+    coef_table['Origin'] = origin
+    coef_table['Observations'] = counts
+    return coef_table[coef_table['Observations'] >= min_obs].reset_index(drop=True)
+
+
+# Evaluate the fitted trends for every group and year at once.
+# Returns a prediction cube with one row per group and one column per year.
+def predict_trends(coef_table, years, group_cols):
+    power_cols = [col for col in coef_table.columns if str(col).startswith('x^')]
+    years = np.asarray(years)
+    # Every group shares the origin, so the design matrix of the years is the same for all of them
+    origin = coef_table['Origin'].iloc[0] if len(coef_table) else 0.0
+    features = polynomial_features(years - origin, len(power_cols))
+    predictions = coef_table['Intercept'].to_numpy()[:, None] + coef_table[power_cols].to_numpy() @ features.T
+    return pd.DataFrame(
+        predictions,
+        index=pd.MultiIndex.from_frame(coef_table[group_cols]),
+        columns=pd.Index(years, name='Year'),
+    )
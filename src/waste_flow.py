@@ -0,0 +1,109 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from demand_projection import DemandCube, GRAMS_PER_DAY_TO_TONNES_PER_YEAR, load_total_population, population_demand
+from harmonization import aggregate_columns
+from schema import FOOD_CATEGORIES
+
+MATSVINN_PATH = os.path.join(os.path.dirname(__file__), '..', 'data', 'raw', 'matsvinn', 'matsvinn.xlsx')
+
+# Stages of the supply chain in flow order, every stage passes what it does not waste on to the next
+STAGES = ['Food Industry', 'Wholesaler', 'Retailer', 'Household']
+PERSONS_PER_HOUSEHOLD = 2
+
+# The flow arrays are (..., stage, year, category), leading axes (e.g. scenarios) are carried along
+STAGE_AXIS = -3
+
+
+#%% Waste per stage
+def load_stage_waste(file_path=MATSVINN_PATH, population=None, persons_per_household=PERSONS_PER_HOUSEHOLD):
+    # (stage, year, category) waste in tonnes per year for the years every chain sheet reports.
+    # The household sheet is kg per household and year, it is scaled with the SSB population of each year.
+    sheets = pd.read_excel(file_path, sheet_name=None)
+    chain = {stage: aggregate_columns(sheets[stage].set_index('Year'), 'foodwaste') for stage in STAGES[:-1]}
+    household = aggregate_columns(sheets['Household'].set_index('Type Mat').T, 'foodwaste').sum()
+
+    years = sorted(set.intersection(*(set(df.index) for df in chain.values())))
+    present = set(household.index).union(*(df.columns for df in chain.values()))
+    categories = [category for category in FOOD_CATEGORIES if category in present]
+
+    population = load_total_population() if population is None else population
+    households = pd.Series(population).reindex(years).to_numpy(dtype=float) / persons_per_household
+    if np.isnan(households).any():
+        raise KeyError(f'No population for all of the years {years}')
+
+    values = np.zeros((len(STAGES), len(years), len(categories)))
+    for i, stage in enumerate(STAGES[:-1]):
+        values[i] = chain[stage].reindex(index=years, columns=categories, fill_value=0).to_numpy(dtype=float)
+    values[-1] = np.outer(households, household.reindex(categories, fill_value=0).to_numpy(dtype=float)) / 1_000  # kg to tonnes
+    return DemandCube(values, {'stage': STAGES, 'year': years, 'category': categories}, name='Waste (tonnes/year)')
+
+
+def household_consumption(df_pop, df_percapita, years, categories, population=None, survey_year='2014'):
+    # (year, category) food eaten in tonnes per year: the national per-capita intake of the survey
+    # year (the survey intake weighted with the SSB age and gender structure) times each year's population
+    demand = population_demand(df_pop, df_percapita)
+    demand = demand[demand['Year'] == survey_year]
+    percapita = demand.groupby('FoodCategory', observed=True)['Average amount consumed (g)'].sum()
+    percapita = percapita / df_pop[survey_year].sum()
+    population = load_total_population() if population is None else population
+    totals = np.outer(pd.Series(population).reindex(years).to_numpy(dtype=float),
+                      percapita.reindex(categories, fill_value=0).to_numpy(dtype=float))
+    return pd.DataFrame(totals * GRAMS_PER_DAY_TO_TONNES_PER_YEAR, index=pd.Index(years, name='year'),
+                        columns=pd.Index(categories, name='category'))
+
+
+#%% Flow model
+def loss_factors(waste, consumption):
+    # Share of the inflow each stage wastes. Going upstream from what households eat, the inflow of a
+    # stage is the consumption plus the waste of that stage and of every stage after it.
+    downstream = np.flip(np.cumsum(np.flip(waste, STAGE_AXIS), axis=STAGE_AXIS), STAGE_AXIS)
+    inflow = np.expand_dims(consumption, STAGE_AXIS) + downstream
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(inflow > 0, waste / inflow, 0.0)
+
+
+def waste_flows(loss, supply):
+    # Inflow and waste of every stage, and what reaches the plates, when 'supply' enters the first stage.
+    # The share reaching a stage is the product of what every earlier stage kept.
+    kept = np.cumprod(1 - loss, axis=STAGE_AXIS)
+    first = np.ones_like(np.take(kept, [0], axis=STAGE_AXIS))
+    reaching = np.concatenate([first, np.delete(kept, -1, axis=STAGE_AXIS)], axis=STAGE_AXIS)
+    inflow = np.expand_dims(supply, STAGE_AXIS) * reaching
+    consumption = np.take(inflow, -1, axis=STAGE_AXIS) * np.take(1 - loss, -1, axis=STAGE_AXIS)
+    return inflow, inflow * loss, consumption
+
+
+class WasteFlowModel:
+    # Stage x category loss factors calibrated on the reported waste of every year. The supply entering
+    # the chain is the consumption plus all waste; scenarios keep that supply and change the loss factors,
+    # so less waste means more food reaching the households. Categories without survey intake (beverages
+    # are not in the per-capita exports) lose everything at the last stage that reports waste.
+    def __init__(self, waste, consumption):
+        self.coords = dict(waste.coords)
+        self.waste = waste.values
+        self.consumption = consumption.reindex(index=self.coords['year'], columns=self.coords['category']).to_numpy(dtype=float)
+        self.loss = loss_factors(self.waste, self.consumption)
+        self.supply = self.consumption + self.waste.sum(axis=STAGE_AXIS)
+
+    def cubes(self, inflow, waste, consumption, coords):
+        plate_coords = {dim: labels for dim, labels in coords.items() if dim != 'stage'}
+        return (DemandCube(inflow, coords, name='Inflow (tonnes/year)'),
+                DemandCube(waste, coords, name='Waste (tonnes/year)'),
+                DemandCube(consumption, plate_coords, name='Consumption (tonnes/year)'))
+
+    def flows(self, loss=None):
+        return self.cubes(*waste_flows(self.loss if loss is None else loss, self.supply), self.coords)
+
+    def scenarios(self, reductions, names=None):
+        # Inflow, waste and consumption for a batch of scenarios in one call. reductions is the fraction by
+        # which each loss factor is cut, shaped (scenario, stage) or (scenario, stage, category).
+        reductions = np.asarray(reductions, dtype=float)
+        if reductions.ndim == 2:
+            reductions = reductions[:, :, None]
+        reductions = np.broadcast_to(reductions, (len(reductions), len(STAGES), len(self.coords['category'])))
+        loss = self.loss[None] * (1 - reductions[:, :, None, :])
+        coords = {'scenario': range(len(reductions)) if names is None else names, **self.coords}
+        return self.cubes(*waste_flows(loss, self.supply), coords)
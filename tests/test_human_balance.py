@@ -0,0 +1,72 @@
+import os
+import shutil
+import subprocess
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+ROOT = os.path.join(os.path.dirname(__file__), '..')
+INPUT = os.path.join('data', 'auxiliary', 'Average consumption by age and gender.xlsx')
+
+
+def test_human_balance_script_runs_end_to_end(tmp_path):
+    # The script runs on a copy of src and its input, so the tracked outputs are not overwritten
+    shutil.copytree(os.path.join(ROOT, 'src'), tmp_path / 'src', ignore=shutil.ignore_patterns('*.ipynb', '__pycache__'))
+    (tmp_path / 'data' / 'auxiliary').mkdir(parents=True)
+    shutil.copy(os.path.join(ROOT, INPUT), tmp_path / INPUT)
+
+    result = subprocess.run([sys.executable, 'human_balance.py'], cwd=tmp_path / 'src', capture_output=True, text=True,
+                            env={**os.environ, 'MPLBACKEND': 'Agg'})
+    assert result.returncode == 0, result.stderr
+
+    balance = pd.read_excel(tmp_path / 'data' / 'auxiliary' / 'human_balance.xlsx')
+    consumption = pd.read_excel(tmp_path / INPUT)
+    assert len(balance) == len(consumption)
+    # Every gram of carbon leaves as CO2, CH4, feces or urine, or is retained: the group's net retention
+    # is split over the food categories by their share of the group's carbon intake
+    group_intake = balance.groupby(['Gender', 'AgeGroup'])['Carbon_Intake'].transform('sum')
+    retained = balance['NetCarbonRetention'] * balance['Carbon_Intake'] / group_intake
+    outputs = balance[['Carbon_CO2', 'Carbon_CH4', 'Carbon_Feces', 'Carbon_Urine']].sum(axis=1) + retained
+    assert (outputs - balance['Carbon_Intake']).abs().max() < 1e-9
+    # Adolescents grow, so they retain carbon; adults are in balance
+    retention = balance.groupby('AgeGroup')['NetCarbonRetention'].first()
+    assert retention['10-19'] > 0 and retention['30-39'] == 0
+
+    uncertainty = pd.read_excel(tmp_path / 'data' / 'auxiliary' / 'human_balance_uncertainty.xlsx')
+    assert len(uncertainty) == len(consumption)
+    assert (uncertainty['Carbon_CO2_p5'] <= uncertainty['Carbon_CO2_p95']).all()
+
+
+def test_missing_net_carbon_retention_raises():
+    sys.path.insert(0, os.path.join(ROOT, 'src'))
+    from human_balance_model import HumanBalanceModel, net_carbon_retention
+
+    consumption = pd.DataFrame({'Gender': ['Female', 'Male'], 'AgeGroup': ['10-19', '10-19'], 'FoodCategory': ['Fish', 'Fish'],
+                                'Carbohydrates': [10.0, 12.0], 'Protein': [20.0, 25.0], 'Fat': [5.0, 6.0],
+                                'Calories': [600.0, 700.0], 'Phosphorus': [300.0, 350.0]})
+    model = HumanBalanceModel(carbon_retention=net_carbon_retention[['Female']])
+    with pytest.raises(KeyError, match='Male 10-19'):
+        model.run(consumption)
+    # Without retention all absorbed carbon that is not excreted or emitted as CH4 leaves as CO2
+    balance = model.run(consumption, zero_retention=True)
+    outputs = balance[['Carbon_CO2', 'Carbon_CH4', 'Carbon_Feces', 'Carbon_Urine']].sum(axis=1)
+    assert np.allclose(outputs, balance['Carbon_Intake'])
+
+
+def test_missing_values_do_not_spread_to_the_group():
+    sys.path.insert(0, os.path.join(ROOT, 'src'))
+    from human_balance_model import HumanBalanceModel
+
+    consumption = pd.DataFrame({'Gender': ['Female'] * 3, 'AgeGroup': ['30-39'] * 3, 'FoodCategory': ['Fish', 'Eggs', 'Legumes'],
+                                'Carbohydrates': [10.0, np.nan, 4.0], 'Protein': [20.0, 8.0, 6.0], 'Fat': [5.0, 3.0, 1.0],
+                                'Calories': [600.0, np.nan, 200.0], 'Phosphorus': [300.0, 100.0, 80.0]})
+    balance = HumanBalanceModel().run(consumption)
+    # The group totals skip the missing values like a groupby sum and mean
+    assert balance['TotalCalories'].eq(800.0).all()
+    assert balance['AverageEnergyIntake'].eq(400.0).all()
+    assert balance.loc[[0, 2], 'Carbon_CO2'].notna().all()
+    assert np.isclose(balance.loc[1, 'Carbon_Intake'], 8.0 * 0.53 + 3.0 * 0.77)
+    uncertainty = HumanBalanceModel().simulate(consumption, n_draws=200, seed=0)
+    assert uncertainty.loc[[0, 2], 'Carbon_CO2_p50'].notna().all()
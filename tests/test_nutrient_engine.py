@@ -0,0 +1,27 @@
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+ROOT = os.path.join(os.path.dirname(__file__), '..')
+
+
+def test_rows_without_composition_data_are_nan():
+    sys.path.insert(0, os.path.join(ROOT, 'src'))
+    from nutrient_engine import nutrient_columns, nutrient_totals
+
+    composition = pd.DataFrame({'FoodCategory': ['Bread', 'Milk']})
+    for i, column in enumerate(nutrient_columns.values()):
+        composition[column] = [10.0 * (i + 1), 20.0 * (i + 1)]
+    df = pd.DataFrame({'FoodCategory': ['Milk', 'Fish', None, 'Bread'],
+                       'Average amount consumed (g)': [200.0, 50.0, 30.0, 100.0]})
+
+    # A left merge on the composition table gives NaN for the unmatched category and the missing one,
+    # they must not be placed in another category's column
+    merged = df.merge(composition, on='FoodCategory', how='left')
+    expected = merged[list(nutrient_columns.values())].mul(merged['Average amount consumed (g)'], axis=0) / 100
+    for categories in (df['FoodCategory'], df['FoodCategory'].astype('category')):
+        totals = nutrient_totals(df.assign(FoodCategory=categories), composition)
+        np.testing.assert_allclose(totals.to_numpy(), expected.to_numpy())
+        assert totals.iloc[[1, 2]].isna().all().all()